@@ -1,18 +1,68 @@
-from fire import Fire
-from bot.server import main
-from memos.memosapi import Memo, Tag, Resource
-from memos.tools import Tool
-from loguru import logger
+import importlib
+import sys
+from memos.daemon import forward
+
+# 每个命令组只在被调用时才导入, 例如memo命令不会加载telebot
+GROUPS = {
+    'bot': ('bot.server', 'main'),
+    'memo': ('memos.memosapi', 'Memo'),
+    'tag': ('memos.memosapi', 'Tag'),
+    'resource': ('memos.memosapi', 'Resource'),
+    'tool': ('memos.tools', 'Tool'),
+    'sync': ('memos.mirror', 'sync'),
+    'daemon': ('memos.daemon', 'Daemon')
+}
+
+
+def load(group: str):
+    module, attr = GROUPS[group]
+    return getattr(importlib.import_module(module), attr)
+
+
+def setup_logging(enqueue: bool = False) -> None:
+    """配置日志文件, 只有长期运行的bot才需要enqueue的后台写日志线程"""
+    from loguru import logger
+    logger.remove(handler_id=None)
+    logger.add('logs/memos-info-{time}.log', format="{time} {level} {message}", filter=lambda record: 'INFO' in record['level'].name, enqueue=enqueue, rotation='00:00', retention='15 days')
+    logger.add('logs/memos-debug-{time}.log', format="{time} {level} {message}", filter=lambda record: 'DEBUG' or 'ERROR' in record['level'].name, enqueue=enqueue, rotation='00:00', retention='15 days')
+
+
+def cleanup() -> None:
+    # 没有导入过memosapi就没有连接和指标需要处理
+    if 'memos.memosapi' not in sys.modules:
+        return
+    from memos.memosapi import sessions, memo_cache, host_policies
+    from memos.metrics import request_metrics
+    # 先取消后台探测, 再关闭连接池
+    host_policies.reset()
+    sessions.close_all()
+    if request_metrics.report_at_exit:
+        print(request_metrics.summary_table())
+        if memo_cache.size > 0:
+            print(f'memo缓存：{memo_cache.stats()}')
+
+
+def cli(argv: list = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    group = argv[0] if argv else None
+    # 守护进程在运行时由它执行, 本进程不导入memosapi也不建立连接
+    code = forward(group, argv[1:])
+    if code is not None:
+        sys.exit(code)
+    # fire和loguru在确定要在本进程执行后才导入, 转发给守护进程的命令用不到
+    from fire import Fire
+    from memos.records import plain
+    setup_logging(enqueue=group in ('bot', 'daemon'))
+    try:
+        if group in GROUPS:
+            # 接口返回的记录按dict输出, 和直接返回响应数据时一样
+            Fire(load(group), command=argv[1:], name=f'app.py {group}', serialize=plain)
+        else:
+            # 查看帮助或者拼错命令时才导入全部
+            Fire({name: load(name) for name in GROUPS}, command=argv, name='app.py', serialize=plain)
+    finally:
+        cleanup()
 
-logger.remove(handler_id=None)
-logger.add('logs/memos-info-{time}.log', format="{time} {level} {message}", filter=lambda record: 'INFO' in record['level'].name, enqueue=True, rotation='00:00', retention='15 days')
-logger.add('logs/memos-debug-{time}.log', format="{time} {level} {message}", filter=lambda record: 'DEBUG' or 'ERROR' in record['level'].name, enqueue=True, rotation='00:00', retention='15 days')
 
 if __name__ == '__main__':
-    Fire({
-        'bot': main,
-        'memo': Memo,
-        'tag': Tag,
-        'resource': Resource,
-        'tool': Tool
-    })
\ No newline at end of file
+    cli()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""对本地替身服务跑Memo、Tag、Resource和Tool的基准测试, 结果输出为JSON
+
+python -m benchmarks run --total=500 --concurrency=16 --latency=0.005 --output=bench.json
+python -m benchmarks compare old.json new.json
+"""
+
+import asyncio
+import json
+import statistics
+import subprocess
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Awaitable, Callable, List
+from fire import Fire
+from loguru import logger
+from benchmarks.server import StandInServer
+
+
+def percentiles(samples: List[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+    return {
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3)
+    }
+
+
+async def measure(total: int, concurrency: int, op: Callable[[int], Awaitable]) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await op(i)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(total)])
+    seconds = time.perf_counter() - start
+    return {'requests': total, 'errors': errors, 'rps': round(total / seconds, 1), **percentiles(latencies)}
+
+
+async def client_ops(server: StandInServer, total: int, concurrency: int, upload_size: int) -> dict:
+    from memos.memosapi import Memo, Resource
+
+    memo = Memo(server.open_api)
+    res = Resource(server.open_api)
+    results = {}
+    ids = []
+
+    async def send(i: int) -> None:
+        ids.append(await memo.send_memo(text=f'#bench 第{i}条memo'))
+
+    results['send_memo'] = await measure(total, concurrency, send)
+    results['update_memo'] = await measure(total, concurrency,
+                                           lambda i: memo.update_memo(ids[i % len(ids)], text=f'#bench 更新{i}'))
+    results['get_memo'] = await measure(total, concurrency, lambda i: memo.get_memo(ids[i % len(ids)]))
+    results['filter_memo'] = await measure(total, concurrency, lambda i: memo.filter_memo(tag='bench', limit=20))
+
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(b'\0' * upload_size)
+        f.flush()
+        results['upload_resource'] = await measure(total, concurrency,
+                                                   lambda i: res.upload_resource(Path(f.name), filename=f'{i}.png'))
+    results['upload_resource_by_stream'] = await measure(
+        total, concurrency,
+        lambda i: res.upload_resource_by_stream(f'{server.base}/file/{upload_size}', filename=f'{i}.png'))
+    return results
+
+
+async def tool_ops(latency: float, jitter: float, error_rate: float, items: int, runs: int, concurrency: int) -> dict:
+    from memos.memosapi import close_sessions, tag_registry
+    from memos.tools import Tool
+
+    async def run_op(name: str, seed: Callable[[StandInServer], None], call: Callable[[Tool], Awaitable]) -> dict:
+        durations = []
+        summary = {}
+        for _ in range(runs):
+            server = StandInServer(latency, jitter, error_rate)
+            seed(server)
+            await server.start()
+            tag_registry.invalidate()
+            try:
+                tool = Tool(concurrency=concurrency, token=server.open_api)
+                start = time.perf_counter()
+                summary = await call(tool) or {}
+                durations.append(time.perf_counter() - start)
+            finally:
+                await close_sessions()
+                await server.stop()
+        mean = statistics.fmean(durations)
+        return {'items': items, 'runs': runs, 'items_per_s': round(items / mean, 1),
+                'succeeded': summary.get('succeeded'), 'failed': summary.get('failed'), **percentiles(durations)}
+
+    return {
+        'tool.rename_tag': await run_op(
+            'rename_tag',
+            lambda s: s.seed(memos=items, tags=['bench']),
+            lambda t: t.rename_tag('bench', 'renamed')),
+        'tool.public_memos': await run_op(
+            'public_memos',
+            lambda s: s.seed(memos=items, tags=['bench']),
+            lambda t: t.public_memos('bench')),
+        'tool.clear_resource': await run_op(
+            'clear_resource',
+            lambda s: s.seed(resources=items),
+            lambda t: t.clear_resource()),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+async def bench(total: int, concurrency: int, latency: float, jitter: float, error_rate: float,
+                upload_size: int, items: int, runs: int) -> dict:
+    from memos.memosapi import close_sessions
+
+    server = StandInServer(latency, jitter, error_rate)
+    await server.start()
+    try:
+        results = await client_ops(server, total, concurrency, upload_size)
+    finally:
+        await close_sessions()
+        await server.stop()
+    results.update(await tool_ops(latency, jitter, error_rate, items, runs, concurrency))
+    return results
+
+
+def run(total: int = 500,
+        concurrency: int = 16,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        upload_size: int = 100 * 1024,
+        items: int = 500,
+        runs: int = 3,
+        output: str = None) -> None:
+    """运行全部基准测试
+
+    Args:
+        total (int, optional): 每个客户端操作的请求数. Defaults to 500.
+        concurrency (int, optional): 并发数. Defaults to 16.
+        latency (float, optional): 替身服务每个请求的延迟秒数. Defaults to 0.0.
+        jitter (float, optional): 延迟抖动秒数. Defaults to 0.0.
+        error_rate (float, optional): 替身服务返回500的概率. Defaults to 0.0.
+        upload_size (int, optional): 上传资源的字节数. Defaults to 100*1024.
+        items (int, optional): Tool批量操作的条目数. Defaults to 500.
+        runs (int, optional): Tool批量操作重复次数. Defaults to 3.
+        output (str, optional): 结果写入的JSON文件. Defaults to None.
+    """
+    logger.remove()
+    results = asyncio.run(bench(total, concurrency, latency, jitter, error_rate, upload_size, items, runs))
+    data = {
+        'commit': git_commit(),
+        'params': {
+            'total': total, 'concurrency': concurrency, 'latency': latency, 'jitter': jitter,
+            'error_rate': error_rate, 'upload_size': upload_size, 'items': items, 'runs': runs
+        },
+        'results': results
+    }
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if output:
+        Path(output).write_text(text, encoding='utf-8')
+    print(text)
+
+
+def compare(old: str, new: str) -> None:
+    """对比两次结果, 输出每项吞吐和p95的变化
+    """
+    before = json.loads(Path(old).read_text(encoding='utf-8'))['results']
+    after = json.loads(Path(new).read_text(encoding='utf-8'))['results']
+    for name in after:
+        if name not in before:
+            continue
+        line = [f'{name:32}']
+        for metric in ('rps', 'items_per_s', 'p95_ms'):
+            if metric in before[name] and metric in after[name] and before[name][metric]:
+                ratio = after[name][metric] / before[name][metric]
+                line.append(f'{metric} {before[name][metric]} -> {after[name][metric]} ({ratio:.2f}x)')
+        print('  '.join(line))
+
+
+if __name__ == '__main__':
+    Fire({'run': run, 'compare': compare})
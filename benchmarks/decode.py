@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""memo列表的解码耗时和内存: 旧路径(json解码两次, 保留dict) vs 新路径(解码一次, 转成MemoRecord)
+
+python -m benchmarks.decode run --memos=50000 --resources=2
+"""
+
+import gc
+import json
+import time
+import tracemalloc
+
+from fire import Fire
+from memos.records import json_loads, memo_records
+
+
+def payload(memos: int, resources: int) -> bytes:
+    """生成和/api/memo一样结构的响应体"""
+    data = []
+    for i in range(1, memos + 1):
+        data.append({
+            'id': i, 'rowStatus': 'NORMAL', 'creatorId': 1, 'createdTs': 1680000000 + i,
+            'updatedTs': 1680000000 + i, 'content': f'#bench 第{i}条memo, 带一点正文内容用来占空间',
+            'visibility': 'PRIVATE', 'pinned': False, 'creatorName': 'bench',
+            'resourceList': [{
+                'id': i * 10 + r, 'creatorId': 1, 'createdTs': 1680000000, 'updatedTs': 1680000000,
+                'filename': f'{i}-{r}.png', 'externalLink': '', 'type': 'image/png', 'size': 1024,
+                'linkedMemoAmount': 1
+            } for r in range(resources)]
+        })
+    return json.dumps({'data': data}, ensure_ascii=False).encode('utf-8')
+
+
+def legacy(body: bytes) -> list:
+    """旧实现: 日志里解码一次, 返回前再解码一次, 结果是dict"""
+    text = body.decode('utf-8')
+    json.loads(text)
+    return json.loads(text)['data']
+
+
+def current(body: bytes) -> list:
+    return memo_records(json_loads(body)['data'])
+
+
+def measure(decode, body: bytes) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = decode(body)
+    seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert data[-1]['resourceList'] is not None
+    del data
+    return {'seconds': round(seconds, 3), 'retained_mb': round(retained / 1024 ** 2, 1),
+            'peak_mb': round(peak / 1024 ** 2, 1)}
+
+
+def run(memos: int = 50000, resources: int = 2) -> None:
+    """分别测量两种解码方式, 每种只跑一次, 避免互相影响tracemalloc
+
+    Args:
+        memos (int, optional): memo条数. Defaults to 50000.
+        resources (int, optional): 每条memo的资源数. Defaults to 2.
+    """
+    body = payload(memos, resources)
+    results = {'bytes': len(body), 'legacy': measure(legacy, body), 'current': measure(current, body)}
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    Fire({'run': run})
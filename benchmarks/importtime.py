@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""每个CLI命令组的导入耗时, 用python -X importtime在独立子进程里测量
+
+命令组导入了不需要的重量级依赖时以非0状态退出, 可以直接用在CI里.
+
+python -m benchmarks.importtime run --runs=5
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+
+from pathlib import Path
+from fire import Fire
+
+ROOT = Path(__file__).resolve().parent.parent
+# 命令组不需要的重量级依赖, 出现在导入列表里说明懒加载失效了
+HEAVY = ['telebot', 'markdownify', 'bs4', 'sqlite3']
+# 确实需要重量级依赖的命令组, 其余命令组出现HEAVY里的模块都算失败
+ALLOWED = {
+    'bot': set(HEAVY),
+    'sync': {'sqlite3'}
+}
+
+
+def measure(group: str) -> dict:
+    """导入app并加载一个命令组, 返回总耗时和导入过的重量级模块
+
+    解释器启动时的导入(site、encodings)在-c代码执行前完成, 不计入.
+    """
+    code = 'import app' if group == 'app' else f'import app; app.load({group!r})'
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    lines = [line for line in proc.stderr.splitlines() if line.startswith('import time:')]
+    # site是启动阶段最后一个顶层导入
+    start = next(i for i, line in enumerate(lines) if line.endswith('| site')) + 1
+    total = 0
+    modules = set()
+    for line in lines[start:]:
+        _, cumulative_us, name = line.split('|')
+        name = name[1:]
+        # 顶层导入没有缩进, 嵌套导入已经算在cumulative里
+        if not name.startswith(' '):
+            total += int(cumulative_us)
+        modules.add(name.strip().split('.')[0])
+    return {'us': total, 'heavy': sorted(m for m in HEAVY if m in modules)}
+
+
+def run(runs: int = 5, groups: str = None) -> None:
+    """测量`import app`以及每个命令组, 多次取中位数
+
+    Args:
+        runs (int, optional): 每个命令组测量次数. Defaults to 5.
+        groups (str, optional): 逗号分隔的命令组, 默认测量全部. Defaults to None.
+    """
+    sys.path.insert(0, str(ROOT))
+    from app import GROUPS
+
+    names = ['app', *GROUPS] if groups is None else [g for g in str(groups).split(',') if g]
+    results = {}
+    for name in names:
+        samples = [measure(name) for _ in range(runs)]
+        results[name] = {
+            'ms': round(statistics.median(s['us'] for s in samples) / 1000, 1),
+            'heavy': samples[-1]['heavy']
+        }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    violations = {name: unexpected for name, r in results.items()
+                  if (unexpected := sorted(set(r['heavy']) - ALLOWED.get(name, set())))}
+    if violations:
+        for name, unexpected in violations.items():
+            print(f'{name}导入了不需要的模块：{", ".join(unexpected)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    Fire({'run': run})
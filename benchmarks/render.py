@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""bot.render.render_markdown和旧的parse_html(html_text + markdownify)的一致性检查和耗时对比
+
+python -m benchmarks.render check --messages=2000
+python -m benchmarks.render run --messages=2000 --entities=20
+"""
+
+import json
+import random
+import time
+
+from typing import List, Tuple
+from fire import Fire
+from loguru import logger
+from telebot import types
+from bot.parse import parse_html
+from bot.render import render_markdown
+
+WORDS = ['memos', '今天', '记录一下', 'snake_case', 'a*b', 'tg', '   ', '\t', '\n', 'ok', '日记', '2023']
+TAGS = ['memos', '日记', 'read_later', 'tg']
+FORMATS = ['bold', 'italic', 'code', 'pre', 'strikethrough', 'underline', 'spoiler', 'text_link', 'url', 'mention']
+
+# (说明, 文字, entities, 期望的渲染结果)
+CASES = [
+    ('表情在标签前面, offset按UTF-16计算', '😀 #PUBLIC hi',
+     [{'type': 'hashtag', 'offset': 3, 'length': 7}], ('😀 hi', [], [], 'PUBLIC', 'NORMAL')),
+    ('只删除entity本身, 代码块里同样的文字保留', '#PUBLIC #PUBLIC',
+     [{'type': 'hashtag', 'offset': 0, 'length': 7}, {'type': 'code', 'offset': 8, 'length': 7}],
+     (' `#PUBLIC`', [], [], 'PUBLIC', 'NORMAL')),
+    ('嵌套格式', 'bold italic',
+     [{'type': 'bold', 'offset': 0, 'length': 11}, {'type': 'italic', 'offset': 5, 'length': 6}],
+     ('**bold *italic***', [], [], 'PRIVATE', 'NORMAL')),
+    ('资源标签和普通标签', '#RES12 #RESERVE #日记 text',
+     [{'type': 'hashtag', 'offset': 0, 'length': 6}, {'type': 'hashtag', 'offset': 7, 'length': 8},
+      {'type': 'hashtag', 'offset': 16, 'length': 3}],
+     (' #RESERVE #日记 text', ['RESERVE', '日记'], [12], 'PRIVATE', 'NORMAL')),
+    ('没有entity时尖括号按原文保留', 'a <b> & c', None, ('a <b> & c', [], [], 'PRIVATE', 'NORMAL')),
+    ('链接文字和地址相同', 'https://a.com/x_y',
+     [{'type': 'text_link', 'offset': 0, 'length': 17, 'url': 'https://a.com/x_y'}],
+     ('<https://a.com/x_y>', [], [], 'PRIVATE', 'NORMAL')),
+]
+
+
+def message(text: str, entities: List[dict] | None) -> types.Message:
+    data = {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': text}
+    if entities:
+        data['entities'] = entities
+    return types.Message.de_json(data)
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+
+def generate(rng: random.Random, entities: int) -> Tuple[str, List[dict]]:
+    """拼出一条消息, 格式entity互不重叠, 控制标签每种最多出现一次"""
+    parts = []
+    items = []
+    offset = 0
+    controls = ['#PUBLIC', '#ARCHIVED', f'#RES{rng.randint(1, 999)}']
+
+    def add(text: str, entity: dict | None = None) -> None:
+        nonlocal offset
+        if entity is not None:
+            items.append({**entity, 'offset': offset, 'length': utf16_len(text)})
+        parts.append(text)
+        offset += utf16_len(text)
+
+    for _ in range(entities):
+        add(rng.choice(WORDS) + ' ')
+        kind = rng.random()
+        if kind < 0.3:
+            add('#' + rng.choice(TAGS), {'type': 'hashtag'})
+        elif kind < 0.4 and controls:
+            add(controls.pop(rng.randrange(len(controls))), {'type': 'hashtag'})
+        else:
+            fmt = rng.choice(FORMATS)
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+            if fmt == 'text_link':
+                add(words, {'type': fmt, 'url': 'https://example.com/a_b'})
+            elif fmt == 'url':
+                add('https://example.com/a_b', {'type': fmt})
+            elif fmt == 'mention':
+                add('@some_user', {'type': fmt})
+            else:
+                add(words, {'type': fmt})
+        add(' ')
+    add(rng.choice(WORDS))
+    return ''.join(parts), items
+
+
+def corpus(messages: int, entities: int, seed: int) -> List[types.Message]:
+    rng = random.Random(seed)
+    result = []
+    for i in range(messages):
+        text, items = generate(rng, rng.randint(0, entities) if i % 10 else 0)
+        if not items:
+            items = None
+        result.append(message(text, items))
+    return result
+
+
+def legacy(msg: types.Message):
+    return parse_html(msg.text, msg.html_text, msg.entities)
+
+
+def current(msg: types.Message):
+    return render_markdown(msg.text, msg.entities)
+
+
+def check(messages: int = 2000, entities: int = 8, seed: int = 0) -> None:
+    """固定用例断言新渲染器的输出, 随机消息和旧实现逐条对比
+
+    Args:
+        messages (int, optional): 随机消息条数. Defaults to 2000.
+        entities (int, optional): 每条消息最多的entity数. Defaults to 8.
+        seed (int, optional): 随机种子. Defaults to 0.
+    """
+    logger.remove()
+    for name, text, items, expected in CASES:
+        got = current(message(text, items))
+        assert got == expected, f'{name}: {got!r} != {expected!r}'
+    mismatches = []
+    for msg in corpus(messages, entities, seed):
+        old, new = legacy(msg), current(msg)
+        if old != new:
+            mismatches.append({'text': msg.text, 'legacy': old, 'current': new})
+    print(json.dumps({'cases': len(CASES), 'messages': messages, 'mismatches': len(mismatches),
+                      'examples': mismatches[:5]}, ensure_ascii=False, indent=2))
+    assert not mismatches
+
+
+def run(messages: int = 2000, entities: int = 20, seed: int = 0) -> None:
+    """对比每条消息的平均耗时, 旧实现包含生成html_text的时间
+
+    Args:
+        messages (int, optional): 消息条数. Defaults to 2000.
+        entities (int, optional): 每条消息最多的entity数. Defaults to 20.
+        seed (int, optional): 随机种子. Defaults to 0.
+    """
+    logger.remove()
+    msgs = corpus(messages, entities, seed)
+    results = {'messages': messages, 'entities': entities}
+    for name, func in (('legacy', legacy), ('current', current)):
+        start = time.perf_counter()
+        for msg in msgs:
+            func(msg)
+        results[f'{name}_us'] = round((time.perf_counter() - start) / messages * 1e6, 1)
+    results['speedup'] = round(results['legacy_us'] / results['current_us'], 1)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    Fire({'check': check, 'run': run})
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""本地的Memos替身服务, 实现memosapi.py用到的/api/memo、/api/tag和/api/resource接口
+
+可以配置每个请求的延迟和出错概率, 数据都在内存里.
+"""
+
+import asyncio
+import random
+import time
+
+from typing import Dict, List
+from aiohttp import web
+
+CHUNK = b'\0' * (256 * 1024)
+
+
+class StandInServer:
+    """Memos替身服务
+
+    Args:
+        latency (float, optional): 每个请求额外等待的秒数. Defaults to 0.
+        jitter (float, optional): 延迟的随机抖动秒数. Defaults to 0.
+        error_rate (float, optional): 返回500的概率. Defaults to 0.
+        throttle_rate (float, optional): 返回429的概率, 带Retry-After. Defaults to 0.
+        retry_after (float, optional): 429响应的Retry-After秒数. Defaults to 0.
+    """
+    def __init__(self, latency: float = 0, jitter: float = 0, error_rate: float = 0,
+                 throttle_rate: float = 0, retry_after: float = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.throttled = 0
+        self.memos: Dict[int, dict] = {}
+        self.tags: List[str] = []
+        self.resources: Dict[int, dict] = {}
+        self.requests = 0
+        self.errors = 0
+        self._next_memo_id = 1
+        self._next_res_id = 1
+        self.runner: web.AppRunner | None = None
+        self.base = ''
+
+    @property
+    def open_api(self) -> str:
+        return f'{self.base}/api/memo?openId=bench'
+
+    @web.middleware
+    async def inject(self, request: web.Request, handler):
+        self.requests += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate and not request.path.startswith('/file/'):
+            self.errors += 1
+            # 读完请求体, 否则剩下的字节会被当成下一个请求解析
+            await request.read()
+            return web.json_response({'error': 'injected'}, status=500)
+        if self.throttle_rate and random.random() < self.throttle_rate and not request.path.startswith('/file/'):
+            self.throttled += 1
+            await request.read()
+            return web.json_response({'error': 'throttled'}, status=429, headers={'Retry-After': str(self.retry_after)})
+        return await handler(request)
+
+    def seed(self, memos: int = 0, tags: List[str] = None, resources: int = 0, content: str = '#bench 第{i}条memo') -> None:
+        """预置数据
+        """
+        for tag in tags or []:
+            if tag not in self.tags:
+                self.tags.append(tag)
+        for i in range(memos):
+            self._create_memo({'content': content.format(i=i)})
+        for i in range(resources):
+            self._create_resource(f'seed-{i}.png', 'image/png', 0, '')
+
+    def _create_memo(self, data: dict) -> dict:
+        now = int(time.time())
+        memo = {
+            'id': self._next_memo_id,
+            'rowStatus': 'NORMAL',
+            'creatorId': 101,
+            'createdTs': now,
+            'updatedTs': now,
+            'content': data.get('content') or '',
+            'visibility': data.get('visibility', 'PRIVATE'),
+            'pinned': False,
+            'creatorName': 'bench',
+            'resourceIdList': list(data.get('resourceIdList') or [])
+        }
+        self.memos[memo['id']] = memo
+        self._next_memo_id += 1
+        return memo
+
+    def _create_resource(self, filename: str, content_type: str, size: int, external_link: str) -> dict:
+        now = int(time.time())
+        res = {
+            'id': self._next_res_id,
+            'creatorId': 101,
+            'createdTs': now,
+            'updatedTs': now,
+            'filename': filename,
+            'type': content_type,
+            'size': size,
+            'externalLink': external_link
+        }
+        self.resources[res['id']] = res
+        self._next_res_id += 1
+        return res
+
+    def _memo_view(self, memo: dict) -> dict:
+        return {
+            **{k: v for k, v in memo.items() if k != 'resourceIdList'},
+            'resourceList': [self.resources[i] for i in memo['resourceIdList'] if i in self.resources]
+        }
+
+    def _resource_view(self, res: dict) -> dict:
+        linked = sum(1 for m in self.memos.values() if res['id'] in m['resourceIdList'])
+        return {**res, 'linkedMemoAmount': linked}
+
+    async def ping(self, request: web.Request) -> web.Response:
+        return web.json_response({'data': {'id': 101, 'username': 'bench'}})
+
+    async def list_memos(self, request: web.Request) -> web.Response:
+        q = request.query
+        items = [m for m in self.memos.values() if m['rowStatus'] == q.get('rowStatus', 'NORMAL')]
+        if 'tag' in q:
+            items = [m for m in items if f"#{q['tag']}" in m['content']]
+        if 'visibility' in q:
+            items = [m for m in items if m['visibility'] == q['visibility']]
+        items.sort(key=lambda m: (m['pinned'], m['createdTs'], m['id']), reverse=True)
+        offset = int(q.get('offset', 0))
+        limit = int(q['limit']) if 'limit' in q else len(items)
+        return web.json_response({'data': [self._memo_view(m) for m in items[offset:offset + limit]]})
+
+    async def get_memo(self, request: web.Request) -> web.Response:
+        memo = self.memos.get(int(request.match_info['id']))
+        if memo is None:
+            return web.json_response({'error': 'not found'}, status=404)
+        return web.json_response({'data': self._memo_view(memo)})
+
+    async def create_memo(self, request: web.Request) -> web.Response:
+        memo = self._create_memo(await request.json())
+        return web.json_response({'data': self._memo_view(memo)})
+
+    async def patch_memo(self, request: web.Request) -> web.Response:
+        memo = self.memos.get(int(request.match_info['id']))
+        if memo is None:
+            return web.json_response({'error': 'not found'}, status=404)
+        data = await request.json()
+        for field, key in (('content', 'content'), ('visibility', 'visibility'),
+                           ('rowStatus', 'rowStatus'), ('resourceIdList', 'resourceIdList')):
+            if field in data:
+                memo[key] = data[field]
+        memo['updatedTs'] = max(int(time.time()), memo['updatedTs'] + 1)
+        return web.json_response({'data': self._memo_view(memo)})
+
+    async def delete_memo(self, request: web.Request) -> web.Response:
+        self.memos.pop(int(request.match_info['id']), None)
+        return web.json_response({'data': True})
+
+    async def list_tags(self, request: web.Request) -> web.Response:
+        return web.json_response({'data': self.tags})
+
+    async def create_tag(self, request: web.Request) -> web.Response:
+        name = (await request.json())['name']
+        if name not in self.tags:
+            self.tags.append(name)
+        return web.json_response({'data': name})
+
+    async def delete_tag(self, request: web.Request) -> web.Response:
+        name = (await request.json())['name']
+        if name in self.tags:
+            self.tags.remove(name)
+        return web.json_response({'data': True})
+
+    async def list_resources(self, request: web.Request) -> web.Response:
+        return web.json_response({'data': [self._resource_view(r) for r in self.resources.values()]})
+
+    async def create_resource(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        res = self._create_resource(data.get('filename', ''), data.get('type', ''), 0, data.get('externalLink', ''))
+        return web.json_response({'data': self._resource_view(res)})
+
+    async def upload_blob(self, request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        field = await reader.next()
+        size = 0
+        while True:
+            chunk = await field.read_chunk()
+            if not chunk:
+                break
+            size += len(chunk)
+        res = self._create_resource(field.filename or '', field.headers.get('Content-Type', ''), size, '')
+        return web.json_response({'data': self._resource_view(res)})
+
+    async def delete_resource(self, request: web.Request) -> web.Response:
+        self.resources.pop(int(request.match_info['id']), None)
+        return web.json_response({'data': True})
+
+    async def serve_file(self, request: web.Request) -> web.StreamResponse:
+        """模拟Telegram的文件下载, 返回指定字节数"""
+        size = int(request.match_info['size'])
+        resp = web.StreamResponse()
+        resp.content_length = size
+        await resp.prepare(request)
+        while size > 0:
+            n = min(size, len(CHUNK))
+            await resp.write(CHUNK[:n])
+            size -= n
+        await resp.write_eof()
+        return resp
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.inject], client_max_size=0)
+        app.router.add_get('/api/ping', self.ping)
+        app.router.add_get('/api/memo', self.list_memos)
+        app.router.add_post('/api/memo', self.create_memo)
+        app.router.add_get('/api/memo/{id}', self.get_memo)
+        app.router.add_patch('/api/memo/{id}', self.patch_memo)
+        app.router.add_delete('/api/memo/{id}', self.delete_memo)
+        app.router.add_get('/api/tag', self.list_tags)
+        app.router.add_post('/api/tag', self.create_tag)
+        app.router.add_post('/api/tag/delete', self.delete_tag)
+        app.router.add_get('/api/resource', self.list_resources)
+        app.router.add_post('/api/resource', self.create_resource)
+        app.router.add_post('/api/resource/blob', self.upload_blob)
+        app.router.add_delete('/api/resource/{id}', self.delete_resource)
+        app.router.add_get('/file/{size}', self.serve_file)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        self.base = f'http://{host}:{site._server.sockets[0].getsockname()[1]}'
+        return self.base
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
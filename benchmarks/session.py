@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""对比每次请求新建session与共享连接池的吞吐
+
+python -m benchmarks.session --total=2000 --concurrency=32
+"""
+
+import asyncio
+import time
+
+from aiohttp import ClientTimeout
+from aiohttp_retry import RetryClient, ClientSession
+from fire import Fire
+from loguru import logger
+from memos.memosapi import Request, close_sessions
+from benchmarks.server import StandInServer
+
+
+class LegacyRequest:
+    """改造前的Request, 每次请求新建ClientSession"""
+    def __init__(self, *args, **kwargs):
+        self.client_session = ClientSession(trust_env=False)
+        self.retry_client = RetryClient(client_session=self.client_session)
+        self.request = self.retry_client.request(*args, **kwargs)
+
+    async def __aenter__(self):
+        return await self.request
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.client_session.close()
+        await self.retry_client.close()
+
+
+async def run_case(request_cls, url: str, total: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            async with request_cls("GET", url, ssl=False, timeout=ClientTimeout(total=100)) as resp:
+                assert resp.status == 200
+                await resp.json()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(total)])
+    return total / (time.perf_counter() - start)
+
+
+async def bench(total: int, concurrency: int) -> dict:
+    server = StandInServer()
+    server.seed(memos=1)
+    await server.start()
+    url = server.open_api
+    try:
+        legacy = await run_case(LegacyRequest, url, total, concurrency)
+        pooled = await run_case(Request, url, total, concurrency)
+    finally:
+        await close_sessions()
+        await server.stop()
+    return {
+        'total': total,
+        'concurrency': concurrency,
+        'legacy_rps': round(legacy, 1),
+        'pooled_rps': round(pooled, 1),
+        'speedup': round(pooled / legacy, 2)
+    }
+
+
+def main(total: int = 2000, concurrency: int = 32) -> dict:
+    logger.remove()
+    return asyncio.run(bench(total, concurrency))
+
+
+if __name__ == '__main__':
+    Fire(main)
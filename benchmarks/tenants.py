@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""一个后端很慢的租户和若干正常租户同时发更新时, 正常租户的处理延迟: 不分租户(先进先出) vs 按租户轮转
+
+python -m benchmarks.tenants run --fast=4 --updates=50 --slow_latency=0.5
+"""
+
+import asyncio
+import json
+import time
+
+from typing import Dict, List
+from fire import Fire
+from telebot import types
+from benchmarks.__main__ import percentiles
+from bot.dispatch import UpdateDispatcher, chat_id_of
+
+
+def update(update_id: int, chat_id: int) -> types.Update:
+    return types.Update.de_json({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': 'bench'}
+    })
+
+
+async def scenario(fair: bool, fast: int, updates: int, slow_latency: float, fast_latency: float, workers: int) -> dict:
+    """慢租户有多个chat(chat_id为负数), 先到达一批更新; chat 1..fast各是一个正常租户, 随后每个发updates条"""
+    queued: Dict[int, float] = {}
+    latencies: Dict[str, List[float]] = {'slow': [], 'fast': []}
+    done = asyncio.Event()
+    total = updates * (fast + 1)
+
+    async def process(batch: List[types.Update]) -> None:
+        u = batch[0]
+        slow = chat_id_of(u) < 0
+        await asyncio.sleep(slow_latency if slow else fast_latency)
+        latencies['slow' if slow else 'fast'].append(time.perf_counter() - queued[u.update_id])
+        if len(latencies['slow']) + len(latencies['fast']) == total:
+            done.set()
+
+    # 不分租户时所有chat共用一个租户, 并发上限等于worker数
+    dispatcher = UpdateDispatcher(process, workers=workers, maxsize=total,
+                                  tenant=(lambda chat_id: 'slow' if chat_id < 0 else str(chat_id)) if fair else (lambda chat_id: ''),
+                                  tenant_concurrency=2 if fair else workers, tenant_maxsize=total)
+    dispatcher.start()
+    update_id = 0
+    # 慢租户的chat数等于worker数, 不分租户时可以占满所有worker
+    for i in range(updates):
+        update_id += 1
+        queued[update_id] = time.perf_counter()
+        dispatcher.put(update(update_id, -(i % workers) - 1))
+    for i in range(updates):
+        for chat_id in range(1, fast + 1):
+            update_id += 1
+            queued[update_id] = time.perf_counter()
+            dispatcher.put(update(update_id, chat_id))
+    await done.wait()
+    await dispatcher.stop()
+    return {'fast': percentiles(latencies['fast']), 'slow': percentiles(latencies['slow'])}
+
+
+def run(fast: int = 4, updates: int = 50, slow_latency: float = 0.5, fast_latency: float = 0.01, workers: int = 8) -> None:
+    """对比两种调度下正常租户的延迟
+
+    Args:
+        fast (int, optional): 正常租户数. Defaults to 4.
+        updates (int, optional): 每个租户的更新数. Defaults to 50.
+        slow_latency (float, optional): 慢租户处理一条更新的秒数. Defaults to 0.5.
+        fast_latency (float, optional): 正常租户处理一条更新的秒数. Defaults to 0.01.
+        workers (int, optional): worker数. Defaults to 8.
+    """
+    results = {}
+    for name, fair in (('fifo', False), ('fair', True)):
+        results[name] = asyncio.run(scenario(fair, fast, updates, slow_latency, fast_latency, workers))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    Fire({'run': run})
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""资源上传的峰值内存和吞吐, 每个文件大小在独立子进程里测量
+
+python -m benchmarks.upload run --sizes=100K,1M,10M,100M,300M
+"""
+
+import asyncio
+import json
+import resource
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from fire import Fire
+from loguru import logger
+from benchmarks.server import StandInServer
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(size: str) -> int:
+    size = str(size).upper()
+    if size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def one(base: str, size: int, mode: str = 'stream') -> None:
+    """子进程里上传一次, 输出峰值RSS和吞吐"""
+    from memos.memosapi import Resource, close_sessions
+
+    async def upload() -> float:
+        res = Resource(f'{base}/api/memo?openId=bench')
+        try:
+            start = time.perf_counter()
+            if mode == 'stream':
+                res_id = await res.upload_resource_by_stream(f'{base}/file/{size}', filename='bench.bin')
+            else:
+                with tempfile.NamedTemporaryFile() as f:
+                    f.truncate(size)
+                    start = time.perf_counter()
+                    res_id = await res.upload_resource(Path(f.name), filename='bench.bin')
+            seconds = time.perf_counter() - start
+            uploaded = {r['id']: r for r in await res.get_resources()}[res_id]
+            assert uploaded['size'] == size, uploaded
+            return seconds
+        finally:
+            await close_sessions()
+
+    logger.remove()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = asyncio.run(upload())
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'mode': mode,
+        'bytes': size,
+        'seconds': round(seconds, 3),
+        'mb_per_s': round(size / seconds / 1024 ** 2, 1),
+        'baseline_rss_kb': baseline,
+        'peak_rss_kb': peak,
+        'upload_rss_kb': peak - baseline
+    }))
+
+
+async def bench(sizes: list, modes: list) -> list:
+    server = StandInServer()
+    base = await server.start()
+    results = []
+    try:
+        for mode in modes:
+            for size in sizes:
+                proc = await asyncio.create_subprocess_exec(
+                    sys.executable, '-m', 'benchmarks.upload', 'one', base, str(size), mode,
+                    stdout=asyncio.subprocess.PIPE
+                )
+                out, _ = await proc.communicate()
+                results.append(json.loads(out.decode().strip().splitlines()[-1]))
+    finally:
+        await server.stop()
+    return results
+
+
+def run(sizes: str = '100K,1M,10M,100M,300M', modes: str = 'stream,file') -> None:
+    sizes = [parse_size(s) for s in (sizes.split(',') if isinstance(sizes, str) else sizes)]
+    modes = modes.split(',') if isinstance(modes, str) else list(modes)
+    for result in asyncio.run(bench(sizes, modes)):
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    Fire({'run': run, 'one': one})
@@ -1,10 +1,8 @@
-import shelve
-import dbm.gnu
-from pathlib import Path
 from telebot import types
 from loguru import logger
 from telebot.asyncio_filters import IsReplyFilter, TextContainsFilter
 from telebot.async_telebot import AsyncTeleBot
+from bot.store import get_store
 
 
 async def send_auth(message: types.Message, bot: AsyncTeleBot):
@@ -20,23 +18,16 @@ async def bind(message: types.Message, bot: AsyncTeleBot):
     await bot.send_message(message.chat.id, "请输入Memos Open Api.", reply_markup=markup)
 
 async def unbind(message: types.Message, bot: AsyncTeleBot):
-    if (Path(f'db/{message.chat.id}.db')).exists():
-        Path(f'db/{message.chat.id}.db').unlink()
+    if get_store().unbind(message.chat.id):
         await bot.reply_to(message, f'{message.chat.id}.db已经解绑，建议您去Memos后台重置api！')
-        logger.info(f'{message.chat.id}.db已经解绑了，删除{message.chat.id}.db配置文件')
+        logger.info(f'{message.chat.id}.db已经解绑了，删除{message.chat.id}的绑定信息')
     else:
-        logger.info(f'{message.chat.id}.db想要解绑，但未找到{message.chat.id}.db配置文件')
+        logger.info(f'{message.chat.id}.db想要解绑，但未找到{message.chat.id}的绑定信息')
         await bot.reply_to(message, f'{message.chat.id}.db未找到您的绑定信息！')
 
 async def save_info(message: types.Message, bot: AsyncTeleBot):
     if message.text.startswith("http"):
-        if Path('db').exists():
-            pass
-        else:
-            Path('db').mkdir()
-
-        with shelve.Shelf(dbm.gnu.open(f'db/{message.chat.id}.db', 'c'), protocol=None, writeback=True) as f:
-            f['token'] = message.text
+        get_store().bind(message.chat.id, message.text)
         await bot.reply_to(message, f'{message.chat.id}.db绑定{message.text}成功！')
         logger.info(f'{message.chat.id}.db已经注册')
 
@@ -0,0 +1,383 @@
+import asyncio
+import contextvars
+import time
+
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+from urllib.parse import urlparse
+from loguru import logger
+from telebot import types
+from memos.records import json_loads
+
+
+def decode_update(body: bytes) -> types.Update:
+    """解析webhook请求体, 安装了orjson时用orjson
+    """
+    return types.Update.de_json(json_loads(body))
+
+
+def chat_id_of(update: types.Update) -> int:
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    return update.update_id
+
+
+def tenant_of(token: str | None) -> str:
+    """chat绑定的Open API所在主机即租户, 未绑定的chat都归入'-'"""
+    return urlparse(token).netloc if token else '-'
+
+
+class Tenant:
+    """一个Memos实例(主机)的待处理更新和后台任务
+
+    更新按chat分组, 同一个chat的更新按顺序逐个处理; 后台任务(上传图片、应用编辑、创建TAG)不按chat排队, 先于更新处理.
+
+    Args:
+        key (str): 租户标识, 为绑定的Open API的主机
+        concurrency (int): 同时处理的更新和后台任务数上限
+        maxsize (int): 排队更新数上限, 后台任务来自已经接受的更新, 不受限制
+    """
+    def __init__(self, key: str, concurrency: int, maxsize: int):
+        self.key = key
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self.chats: OrderedDict[int, Deque[Tuple[float, types.Update]]] = OrderedDict()
+        self.jobs: Deque[Tuple[float, Tuple[Callable[[], Awaitable], asyncio.Future]]] = deque()
+        self.depth = 0
+        self.running = 0
+        self.scheduled = False
+        self.processed = 0
+        self.jobs_processed = 0
+        self.errors = 0
+        self.rejected = 0
+        self.latency_seconds = 0.0
+        self.max_latency = 0.0
+        self.wait_seconds = 0.0
+
+    def push(self, chat_id: int, update: types.Update) -> bool:
+        if self.depth >= self.maxsize:
+            self.rejected += 1
+            return False
+        self.chats.setdefault(chat_id, deque()).append((time.monotonic(), update))
+        self.depth += 1
+        return True
+
+    def push_job(self, job: Callable[[], Awaitable], future: asyncio.Future) -> None:
+        self.jobs.append((time.monotonic(), (job, future)))
+        self.depth += 1
+
+    def runnable(self, busy_chats: set) -> bool:
+        return self.running < self.concurrency and (bool(self.jobs) or any(chat_id not in busy_chats for chat_id in self.chats))
+
+    def pop(self, busy_chats: set) -> Tuple[int | None, Any]:
+        """先取后台任务, chat_id为None; 否则取下一个不在处理中的chat的第一条更新, 该chat移到末尾, 租户内也按chat轮转"""
+        if self.jobs:
+            chat_id = None
+            queued_at, item = self.jobs.popleft()
+        else:
+            chat_id = next(chat_id for chat_id in self.chats if chat_id not in busy_chats)
+            queue = self.chats.pop(chat_id)
+            queued_at, item = queue.popleft()
+            if queue:
+                self.chats[chat_id] = queue
+        self.depth -= 1
+        self.running += 1
+        self.wait_seconds += time.monotonic() - queued_at
+        return chat_id, item
+
+    def done(self, seconds: float, ok: bool, job: bool = False) -> None:
+        self.running -= 1
+        self.processed += 1
+        self.jobs_processed += job
+        self.errors += not ok
+        self.latency_seconds += seconds
+        self.max_latency = max(self.max_latency, seconds)
+
+    def stats(self) -> dict:
+        processed = max(self.processed, 1)
+        return {
+            'queue_depth': self.depth,
+            'running': self.running,
+            'processed': self.processed,
+            'jobs': self.jobs_processed,
+            'errors': self.errors,
+            'rejected': self.rejected,
+            'avg_latency_ms': round(self.latency_seconds / processed * 1000, 1),
+            'max_latency_ms': round(self.max_latency * 1000, 1),
+            'avg_wait_ms': round(self.wait_seconds / processed * 1000, 1)
+        }
+
+
+# 当前任务正在处理的(调度器, 租户), 用于wait让出名额
+_current: contextvars.ContextVar[Tuple['UpdateDispatcher', Tenant] | None] = contextvars.ContextVar('dispatch_current', default=None)
+# 正在运行的调度器, polling模式下没有
+_active: 'UpdateDispatcher | None' = None
+_background = set()
+
+
+def submit(chat_id: int, job: Callable[[], Awaitable]) -> asyncio.Future:
+    """执行更新处理之外的Memos请求, webhook模式下放进chat所属租户的队列, 和更新共用并发上限
+
+    polling模式没有调度器, 直接创建任务. 调度器停止后提交的任务直接取消.
+
+    Args:
+        chat_id (int): 任务所属的chat
+        job (Callable[[], Awaitable]): 返回协程的函数, 轮到时才调用
+
+    Returns:
+        asyncio.Future: 任务的结果
+    """
+    if _active is not None:
+        return _active.submit(chat_id, job)
+    task = asyncio.ensure_future(job())
+    # 保留引用, 防止任务还没执行完就被回收
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def wait(aw: Awaitable) -> Any:
+    """处理更新时等待后台任务的结果, 等待期间让出全局和租户的名额
+
+    否则处理中的更新占满名额后, 它们等待的后台任务永远轮不到.
+    """
+    current = _current.get()
+    if current is None:
+        return await aw
+    dispatcher, tenant = current
+    return await dispatcher._wait(tenant, aw)
+
+
+class UpdateDispatcher:
+    """最多workers个更新同时处理, 按租户公平调度
+
+    每个chat按绑定的Memos实例归入一个租户, 调度在有待处理更新的租户之间轮转,
+    每个租户同时处理的更新数有上限, 后端慢的租户不会占满所有名额, 也不会让其他租户排在它后面.
+    图片上传、编辑和创建TAG等后台任务通过submit进入同一个租户队列, 同样受这两个上限约束.
+    同一个chat的更新按顺序逐个处理. 队列满(总数或单个租户)或者正在停止时put返回False,
+    由webhook返回503让Telegram稍后重试.
+
+    Args:
+        process (Callable[[List[types.Update]], Awaitable]): 处理更新, 一般是bot.process_new_updates
+        workers (int, optional): 同时处理的更新和后台任务总数. Defaults to 8.
+        maxsize (int, optional): 所有租户排队更新的总数上限. Defaults to 256.
+        tenant (Callable[[int], str], optional): 根据chat_id返回租户标识. Defaults to 所有chat同一个租户.
+        tenant_concurrency (int, optional): 每个租户同时处理的更新和后台任务数. Defaults to 2.
+        tenant_maxsize (int, optional): 每个租户排队更新数上限. Defaults to 64.
+    """
+    def __init__(self,
+                 process: Callable[[List[types.Update]], Awaitable],
+                 workers: int = 8,
+                 maxsize: int = 256,
+                 tenant: Callable[[int], str] = lambda chat_id: '',
+                 tenant_concurrency: int = 2,
+                 tenant_maxsize: int = 64):
+        self.process = process
+        self.workers = max(1, workers)
+        self.maxsize = max(1, maxsize)
+        self.tenant = tenant
+        self.tenant_concurrency = max(1, tenant_concurrency)
+        self.tenant_maxsize = max(1, tenant_maxsize)
+        self.tenants: Dict[str, Tenant] = {}
+        self.depth = 0
+        self.busy = 0
+        # 在wait里等待后台任务的更新和任务, 不占名额但还没处理完
+        self.waiting = 0
+        self.processed = 0
+        self.rejected = 0
+        self.closed = True
+        self.started = time.monotonic()
+        self._halted = False
+        self._busy_seconds = 0.0
+        self._busy_chats = set()
+        # 有可处理更新的租户, 每个租户最多出现一次, 从队首取, 还能继续处理的放回队尾
+        self._ready: Deque[Tenant] = deque()
+        self._tasks = set()
+        self._drained = asyncio.Event()
+
+    def start(self) -> None:
+        global _active
+        self.started = time.monotonic()
+        self.closed = False
+        self._halted = False
+        _active = self
+        self._pump()
+
+    async def stop(self, timeout: float = 30) -> None:
+        """停止接收更新, 等待已经接受的更新和后台任务处理完再取消
+
+        这些更新已经给Telegram返回了200, 直接取消会丢失, 也可能在发送memo之后、保存消息映射之前被打断.
+
+        Args:
+            timeout (float, optional): 最多等待的秒数, 超时后取消剩下的更新. Defaults to 30.
+        """
+        self.closed = True
+        if self.depth or self.busy or self.waiting:
+            self._drained.clear()
+            try:
+                await asyncio.wait_for(self._drained.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f'等待更新处理完成超时，取消{self.busy}个处理中的更新，丢弃{self.depth}个排队的更新')
+        # 不再启动新的更新和后台任务, 之后提交的任务直接取消
+        self._halted = True
+        for tenant in self.tenants.values():
+            for _, (_, future) in tenant.jobs:
+                future.cancel()
+            tenant.jobs.clear()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _tenant(self, chat_id: int) -> Tenant:
+        key = self.tenant(chat_id)
+        tenant = self.tenants.get(key)
+        if tenant is None:
+            tenant = self.tenants[key] = Tenant(key, self.tenant_concurrency, self.tenant_maxsize)
+        return tenant
+
+    def _schedule(self, tenant: Tenant) -> None:
+        if not tenant.scheduled and tenant.runnable(self._busy_chats):
+            tenant.scheduled = True
+            self._ready.append(tenant)
+
+    def _pump(self) -> None:
+        """在总名额内按租户轮转取出更新和后台任务执行"""
+        while not self._halted and self.busy < self.workers and self._ready:
+            tenant = self._ready.popleft()
+            tenant.scheduled = False
+            if not tenant.runnable(self._busy_chats):
+                continue
+            chat_id, item = tenant.pop(self._busy_chats)
+            self.depth -= 1
+            if chat_id is not None:
+                self._busy_chats.add(chat_id)
+            self.busy += 1
+            task = asyncio.create_task(self._run(tenant, chat_id, item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self._schedule(tenant)
+
+    def put(self, update: types.Update) -> bool:
+        chat_id = chat_id_of(update)
+        tenant = self._tenant(chat_id)
+        key = tenant.key
+        if self.closed:
+            self.rejected += 1
+            logger.debug(f'正在停止，拒绝{key}的update{update.update_id}')
+            return False
+        if self.depth >= self.maxsize or not tenant.push(chat_id, update):
+            if self.depth >= self.maxsize:
+                tenant.rejected += 1
+            self.rejected += 1
+            logger.debug(f'更新队列已满，拒绝{key}的update{update.update_id}')
+            return False
+        self.depth += 1
+        self._schedule(tenant)
+        self._pump()
+        return True
+
+    def submit(self, chat_id: int, job: Callable[[], Awaitable]) -> asyncio.Future:
+        """把后台任务放进chat所属租户的队列, 停止期间也接受, 它们来自已经接受的更新"""
+        future = asyncio.get_running_loop().create_future()
+        if self._halted:
+            logger.warning(f'调度器已经停止，丢弃chat{chat_id}的后台任务')
+            future.cancel()
+            return future
+        tenant = self._tenant(chat_id)
+        tenant.push_job(job, future)
+        self.depth += 1
+        self._schedule(tenant)
+        self._pump()
+        return future
+
+    async def _run(self, tenant: Tenant, chat_id: int | None, item: Any) -> None:
+        _current.set((self, tenant))
+        start = time.monotonic()
+        ok = True
+        try:
+            if chat_id is None:
+                job, future = item
+                try:
+                    result = await job()
+                except Exception as e:
+                    ok = False
+                    if not future.done():
+                        future.set_exception(e)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            else:
+                try:
+                    await self.process([item])
+                except Exception as e:
+                    ok = False
+                    logger.error(f'处理update{item.update_id}出错，{e}')
+        finally:
+            seconds = time.monotonic() - start
+            self.busy -= 1
+            self.processed += 1
+            self._busy_seconds += seconds
+            if chat_id is not None:
+                self._busy_chats.discard(chat_id)
+            tenant.done(seconds, ok, job=chat_id is None)
+            self._schedule(tenant)
+            self._pump()
+            self._check_drained()
+
+    def _check_drained(self) -> None:
+        if self.closed and not self.depth and not self.busy and not self.waiting:
+            self._drained.set()
+
+    async def _wait(self, tenant: Tenant, aw: Awaitable) -> Any:
+        self.busy -= 1
+        self.waiting += 1
+        tenant.running -= 1
+        self._schedule(tenant)
+        self._pump()
+        try:
+            return await aw
+        finally:
+            # 等待结束后直接占回名额, 可能短暂超过上限, 但不会再等别人让出
+            self.busy += 1
+            self.waiting -= 1
+            tenant.running += 1
+
+    def stats(self) -> dict:
+        uptime = max(time.monotonic() - self.started, 1e-9)
+        return {
+            'workers': self.workers,
+            'busy': self.busy,
+            'waiting': self.waiting,
+            'queue_depth': self.depth,
+            'queue_capacity': self.maxsize,
+            'processed': self.processed,
+            'rejected': self.rejected,
+            'utilisation': round(self.busy / self.workers, 3),
+            'avg_utilisation': round(self._busy_seconds / (uptime * self.workers), 3),
+            'tenants': {key: tenant.stats() for key, tenant in self.tenants.items()}
+        }
+
+    def prometheus(self) -> str:
+        """每个租户的队列深度和处理耗时, 用来找出慢的或者更新特别多的Memos实例"""
+        metrics = [
+            ('memos_tenant_queue_depth', 'gauge', lambda t: t.depth),
+            ('memos_tenant_running', 'gauge', lambda t: t.running),
+            ('memos_tenant_updates_total', 'counter', lambda t: t.processed),
+            ('memos_tenant_jobs_total', 'counter', lambda t: t.jobs_processed),
+            ('memos_tenant_errors_total', 'counter', lambda t: t.errors),
+            ('memos_tenant_rejected_total', 'counter', lambda t: t.rejected),
+            ('memos_tenant_latency_seconds_total', 'counter', lambda t: round(t.latency_seconds, 6)),
+            ('memos_tenant_wait_seconds_total', 'counter', lambda t: round(t.wait_seconds, 6)),
+        ]
+        lines = []
+        for name, kind, value in metrics:
+            lines.append(f'# TYPE {name} {kind}')
+            lines += [f'{name}{{tenant="{key}"}} {value(t)}' for key, t in self.tenants.items()]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,99 @@
+import asyncio
+
+from typing import Awaitable, Callable, Dict, Tuple
+from loguru import logger
+from telebot import types
+from bot.dispatch import submit
+
+
+class EditCoalescer:
+    """合并同一条消息的连续编辑, 防抖结束后只应用最后一次, 同一条消息的更新串行执行, 最后一次更新完成后回复一次
+
+    防抖结束后的更新作为后台任务交给调度器, 停止前调用flush立即提交还在防抖的编辑.
+
+    Args:
+        apply (Callable[[types.Message], Awaitable]): 把编辑后的消息更新到memo
+        reply (Callable[[types.Message, Exception | None], Awaitable]): 更新完成后的回复, 出错时传入异常
+        debounce (float, optional): 最后一次编辑后等待的秒数. Defaults to 1.5.
+    """
+    def __init__(self,
+                 apply: Callable[[types.Message], Awaitable],
+                 reply: Callable[[types.Message, Exception | None], Awaitable],
+                 debounce: float = 1.5):
+        self.apply = apply
+        self.reply = reply
+        self.debounce = debounce
+        self.coalesced = 0
+        self._pending: Dict[Tuple[int, int], Tuple[types.Message, asyncio.TimerHandle | None]] = {}
+        self._locks: Dict[Tuple[int, int], Tuple[asyncio.Lock, int]] = {}
+        self.closing = False
+
+    @staticmethod
+    def key(message: types.Message) -> Tuple[int, int]:
+        return message.chat.id, message.message_id
+
+    def add(self, message: types.Message) -> None:
+        """收到一次编辑, 替换还没应用的上一次编辑并重新计时, 停止期间立即提交
+        """
+        key = self.key(message)
+        entry = self._pending.get(key)
+        if entry is not None:
+            if entry[1] is not None:
+                entry[1].cancel()
+            self.coalesced += 1
+            logger.debug(f'消息{key}的编辑还没应用，合并为最新一次')
+        if self.closing:
+            self._pending[key] = (message, None)
+            # 已经提交过的任务会取到这次编辑
+            if entry is None or entry[1] is not None:
+                self._schedule(key)
+        else:
+            timer = asyncio.get_running_loop().call_later(self.debounce, self._schedule, key)
+            self._pending[key] = (message, timer)
+
+    def _schedule(self, key: Tuple[int, int]) -> None:
+        submit(key[0], lambda: self._flush(key))
+
+    def flush(self) -> None:
+        """取消所有防抖计时, 立即提交还没应用的编辑, 之后的编辑也不再等待, 停止前调用
+        """
+        self.closing = True
+        for key, (message, timer) in list(self._pending.items()):
+            if timer is not None:
+                timer.cancel()
+                self._pending[key] = (message, None)
+                self._schedule(key)
+
+    async def _flush(self, key: Tuple[int, int]) -> None:
+        lock, users = self._locks.get(key) or (asyncio.Lock(), 0)
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                # 等锁期间可能来了新的编辑, 取此刻最新的一次; 已经被前一次取走时不用再更新
+                entry = self._pending.pop(key, None)
+                if entry is None:
+                    return
+                message, timer = entry
+                if timer is not None:
+                    timer.cancel()
+                error = None
+                try:
+                    await self.apply(message)
+                except Exception as e:
+                    error = e
+                # 还有更新的编辑在等待时, 由它来回复
+                if key in self._pending:
+                    return
+                try:
+                    await self.reply(message, error)
+                except Exception as e:
+                    logger.error(f'消息{key}编辑后回复失败，{e}')
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+    def __len__(self) -> int:
+        return len(self._pending)
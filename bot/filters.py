@@ -1,10 +1,10 @@
-from pathlib import Path
 from telebot.asyncio_filters import SimpleCustomFilter
 from telebot.async_telebot import types
+from bot.store import get_store
 
 class ExistDb(SimpleCustomFilter):
     key = 'exist_db'
     @staticmethod
     async def check(message: types.Message):
-       return Path(f'db/{message.chat.id}.db').exists()
+       return get_store().get_token(message.chat.id) is not None
 
@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, List
+from loguru import logger
+from telebot import types
+from bot.dispatch import submit, wait
+
+
+class MediaGroup:
+    def __init__(self):
+        self.messages: List[types.Message] = []
+        self.res_ids: List[int] = []
+        self.errors: List[Exception] = []
+        # 已经开始上传的消息数, 上传期间到达的图片从这里接着上传
+        self.uploaded = 0
+        self.uploading = False
+        self.timer: asyncio.TimerHandle | None = None
+        self.done = asyncio.Event()
+        self.finished_at: float | None = None
+
+
+class MediaGroupAggregator:
+    """把同一个media_group_id的图片攒在一起, 防抖结束后并发上传, 只回复一次
+
+    完成的分组按TTL和数量上限淘汰, 长期运行内存不会一直增长.
+    防抖结束后的上传和回复作为后台任务交给调度器, 停止前调用flush立即提交还在防抖的分组.
+
+    Args:
+        upload (Callable[[types.Message], Awaitable[int]]): 上传单张图片, 返回资源id
+        reply (Callable[[types.Message, List[int], List[Exception]], Awaitable]): 分组完成后的回复
+        debounce (float, optional): 最后一张图片到达后等待的秒数. Defaults to 1.0.
+        ttl (float, optional): 完成的分组保留秒数. Defaults to 3600.
+        max_groups (int, optional): 最多保留的分组数量. Defaults to 1000.
+    """
+    def __init__(self,
+                 upload: Callable[[types.Message], Awaitable[int]],
+                 reply: Callable[[types.Message, List[int], List[Exception]], Awaitable],
+                 debounce: float = 1.0,
+                 ttl: float = 3600,
+                 max_groups: int = 1000):
+        self.upload = upload
+        self.reply = reply
+        self.debounce = debounce
+        self.ttl = ttl
+        self.max_groups = max_groups
+        self._groups: OrderedDict[str | int, MediaGroup] = OrderedDict()
+        self.closing = False
+
+    @staticmethod
+    def key(message: types.Message) -> str | int:
+        return message.media_group_id or message.message_id
+
+    def add(self, message: types.Message) -> None:
+        """收到一张图片, 单张图片立即上传, 相册等待防抖结束
+        """
+        self._evict()
+        key = self.key(message)
+        group = self._groups.get(key)
+        if group is None or group.done.is_set():
+            group = MediaGroup()
+            self._groups[key] = group
+        group.messages.append(message)
+        if group.timer is not None:
+            group.timer.cancel()
+            group.timer = None
+        if self.closing or not message.media_group_id:
+            # 停止期间不再等待, 立即提交
+            self._schedule(key, group)
+        else:
+            group.timer = asyncio.get_running_loop().call_later(self.debounce, self._schedule, key, group)
+
+    def _schedule(self, key: str | int, group: MediaGroup) -> None:
+        submit(group.messages[0].chat.id, lambda: self._flush(key, group))
+
+    def flush(self) -> None:
+        """取消所有防抖计时, 立即提交还没上传的分组, 之后到达的图片也不再等待, 停止前调用
+        """
+        self.closing = True
+        for key, group in list(self._groups.items()):
+            if group.timer is not None:
+                group.timer.cancel()
+                group.timer = None
+                self._schedule(key, group)
+
+    async def _flush(self, key: str | int, group: MediaGroup) -> None:
+        # 正在上传时到达的图片由正在进行的上传接着处理, 每张图片只上传一次, 整个分组只回复一次
+        if group.uploading or group.uploaded == len(group.messages):
+            return
+        group.uploading = True
+        res_ids = {}
+        try:
+            while group.uploaded < len(group.messages):
+                if group.timer is not None:
+                    group.timer.cancel()
+                    group.timer = None
+                batch = group.messages[group.uploaded:]
+                group.uploaded = len(group.messages)
+                # 上传本身也是后台任务, 等待期间让出名额
+                results = await wait(asyncio.gather(*[self.upload(m) for m in batch], return_exceptions=True))
+                for m, r in zip(batch, results):
+                    # 停止时被取消的上传返回CancelledError
+                    if isinstance(r, BaseException):
+                        group.errors.append(r)
+                    else:
+                        res_ids[m.message_id] = r
+        finally:
+            group.uploading = False
+        messages = sorted(group.messages, key=lambda m: m.message_id)
+        group.res_ids = [res_ids[m.message_id] for m in messages if m.message_id in res_ids]
+        group.finished_at = time.monotonic()
+        group.done.set()
+        logger.debug(f'分组{key}上传完成, 资源ID为{group.res_ids}, 失败{len(group.errors)}个')
+        try:
+            await self.reply(messages[0], group.res_ids, group.errors)
+        except Exception as e:
+            logger.error(f'分组{key}回复失败，{e}')
+
+    async def get(self, key: str | int, timeout: float = 60) -> List[int]:
+        """获取分组的资源id, 还在上传时等待完成
+
+        Raises:
+            KeyError: 没有这个分组或已经被淘汰
+        """
+        group = self._groups[key]
+        await asyncio.wait_for(group.done.wait(), timeout)
+        return group.res_ids
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key, group in list(self._groups.items()):
+            if group.finished_at is not None and now - group.finished_at > self.ttl:
+                del self._groups[key]
+        overflow = len(self._groups) - self.max_groups
+        for key in [k for k, g in self._groups.items() if g.done.is_set()][:max(overflow, 0)]:
+            del self._groups[key]
+
+    def __len__(self) -> int:
+        return len(self._groups)
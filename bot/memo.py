@@ -1,135 +1,200 @@
-import shelve
+import hashlib
 import os
-import dbm.gnu
+from typing import List
 from telebot import types
 from loguru import logger
 from telebot.async_telebot import AsyncTeleBot
 from urllib.parse import urlparse
 from memos.memosapi import Memo, Tag, Resource
-from bot.parse import parse_text, parse_html
+from bot.render import render_markdown
 from bot.filters import ExistDb
+from bot.store import get_store, resource_scope
+from bot.media import MediaGroupAggregator
+from bot.edits import EditCoalescer
+from bot.dispatch import submit, wait
 from telebot.asyncio_filters import IsReplyFilter
 
-media_ids = {}
+media_groups: MediaGroupAggregator | None = None
+edits: EditCoalescer | None = None
+
+
+async def create_tags(message: types.Message, url: str, tags: list) -> None:
+    try:
+        created = await Tag(url).ensure_tags(tags)
+        if created:
+            logger.info(f'{message.chat.id}.db发送了成功创建{len(created)}个TAG, TAG为{created}')
+    except Exception as e:
+        logger.error(f'{message.chat.id}.db创建TAG出错，{e}')
 
 async def send_memo_by_words(message: types.Message, bot: AsyncTeleBot):
-    with shelve.Shelf(dbm.gnu.open(f'db/{message.chat.id}.db', 'c'), protocol=None, writeback=True) as f:
-        if f['token']:
-            url = f['token']
-            o = urlparse(str(url))
-            domain = f'{o.scheme}://{o.netloc}/m/'
-
-            try:
-                memo = Memo(url)
-
-                # text, tags, res_ids, visibility, _ = parse_text(message.text)
-                text, tags, res_ids, visibility, status = parse_html(message.text, message.html_text, message.entities)
-                logger.debug(f'\nMemo为: {text}\n Tags为: {tags}\n 公开：{visibility}\n 资源ID：{res_ids}\n 状态为：{status}')
-                memo_id = await memo.send_memo(text=text, visibility=visibility, res_ids=res_ids)
-                memo_url = f'{domain}{memo_id}'
-                f[str(message.message_id)] = memo_id
-
-                logger.info(f'{message.chat.id}.db发送了成功发送了1条Memos, MemoID为{memo_id}')
-
-                memo_tag = Tag(url)
-                for tag in tags:
-                    await memo_tag.create_tag(tag)
-                    logger.info(f'{message.chat.id}.db发送了成功创建1个TAG, TAG为{tag}')
-                await bot.reply_to(message, memo_url)
-            except Exception as e:
-                logger.error(f'{message.chat.id}.db创建Memo出错，{e}')
-                await bot.reply_to(message, f"出错了，重来吧！{e}")
-        else:
-            logger.debug(f'{message.chat.id}.db没有找到token信息')
-            await bot.reply_to(message, f'{message.chat.id}.db未找到您的绑定信息！')
+    store = get_store()
+    url = store.get_token(message.chat.id)
+    if url:
+        o = urlparse(str(url))
+        domain = f'{o.scheme}://{o.netloc}/m/'
+
+        try:
+            memo = Memo(url)
+
+            # text, tags, res_ids, visibility, _ = parse_text(message.text)
+            text, tags, res_ids, visibility, status = render_markdown(message.text, message.entities)
+            logger.debug(f'\nMemo为: {text}\n Tags为: {tags}\n 公开：{visibility}\n 资源ID：{res_ids}\n 状态为：{status}')
+            memo_id = await memo.send_memo(text=text, visibility=visibility, res_ids=res_ids)
+            memo_url = f'{domain}{memo_id}'
+            store.save_message(message.chat.id, message.message_id, memo_id)
+
+            logger.info(f'{message.chat.id}.db发送了成功发送了1条Memos, MemoID为{memo_id}')
+
+            submit(message.chat.id, lambda: create_tags(message, url, tags))
+            await bot.reply_to(message, memo_url)
+        except Exception as e:
+            logger.error(f'{message.chat.id}.db创建Memo出错，{e}')
+            await bot.reply_to(message, f"出错了，重来吧！{e}")
+    else:
+        logger.debug(f'{message.chat.id}.db没有找到token信息')
+        await bot.reply_to(message, f'{message.chat.id}.db未找到您的绑定信息！')
 
 async def send_memo_by_words_and_resource(message: types.Message, bot: AsyncTeleBot):
-    with shelve.Shelf(dbm.gnu.open(f'db/{message.chat.id}.db', 'c'), protocol=None, writeback=True) as f:
-        if f['token']:
-            url = f['token']
-            o = urlparse(str(url))
-            domain = f'{o.scheme}://{o.netloc}/m/'
-
-            try:
-                memo = Memo(url)
-                # text, tags, visibility, _ = parse_text(message.text)
-                text, tags, _, visibility, _ = parse_html(message.text, message.html_text, message.entities)
-                if message.reply_to_message.media_group_id:
-                    res_ids = media_ids[message.reply_to_message.media_group_id]
-                else:
-                    res_ids = media_ids[message.reply_to_message.message_id]
-                logger.debug(f'\nMemo为: {text}\n Tags为: {tags}\n 公开：{visibility}\n 资源ID：{res_ids}')
-
-                memo_id = await memo.send_memo(text=text, visibility=visibility, res_ids=res_ids)
-                f[str(message.message_id)] = memo_id
-                logger.info(f'{message.chat.id}.db发送了成功发送了图文Memos, MemoID为{memo_id}')
-
-                memo_url = f'{domain}{memo_id}'
-                memo_tag = Tag(url)
-                for tag in tags:
-                    await memo_tag.create_tag(tag)
-
-                await bot.reply_to(message, memo_url)
-            except Exception as e:
-                logger.error(f'{message.chat.id}.db发送图文失败，{e}')
-                await bot.reply_to(message, f"出错了，重来吧！{e}")
-        else:
-            await bot.reply_to(message, "未绑定Memos Open API，请先绑定后再使用。")
-            return
+    store = get_store()
+    url = store.get_token(message.chat.id)
+    if url:
+        o = urlparse(str(url))
+        domain = f'{o.scheme}://{o.netloc}/m/'
+
+        try:
+            memo = Memo(url)
+            # text, tags, visibility, _ = parse_text(message.text)
+            text, tags, _, visibility, _ = render_markdown(message.text, message.entities)
+            # 等待上传时让出名额, 上传任务和这条更新用的是同一个租户的名额
+            res_ids = await wait(media_groups.get(MediaGroupAggregator.key(message.reply_to_message)))
+            logger.debug(f'\nMemo为: {text}\n Tags为: {tags}\n 公开：{visibility}\n 资源ID：{res_ids}')
+
+            memo_id = await memo.send_memo(text=text, visibility=visibility, res_ids=res_ids)
+            store.save_message(message.chat.id, message.message_id, memo_id)
+            logger.info(f'{message.chat.id}.db发送了成功发送了图文Memos, MemoID为{memo_id}')
+
+            memo_url = f'{domain}{memo_id}'
+            submit(message.chat.id, lambda: create_tags(message, url, tags))
+            await bot.reply_to(message, memo_url)
+        except Exception as e:
+            logger.error(f'{message.chat.id}.db发送图文失败，{e}')
+            await bot.reply_to(message, f"出错了，重来吧！{e}")
+    else:
+        await bot.reply_to(message, "未绑定Memos Open API，请先绑定后再使用。")
+        return
 
 async def send_resource(message: types.Message, bot: AsyncTeleBot):
-    with shelve.Shelf(dbm.gnu.open(f'db/{message.chat.id}.db', 'c'), protocol=None, writeback=False) as f:
-        if f['token']:
-            url = f['token']
-        else:
-            await bot.reply_to(message, "未绑定Memos Open API，请先绑定后再使用。")
-            return
+    url = get_store().get_token(message.chat.id)
+    if not url:
+        await bot.reply_to(message, "未绑定Memos Open API，请先绑定后再使用。")
+        return
 
     logger.info(f'{message.chat.id}.db请求上传资源')
-    file_path = await bot.get_file(message.photo[-1].file_id)
-    file_url = f'https://api.telegram.org/file/bot{os.getenv("API_TOKEN")}/{file_path.file_path}'
-
-    try:
-        res = Resource(url)
+    media_groups.add(message)
+
+async def find_resource(res: Resource, scope: str, keys: List[str]) -> int | None:
+    """在资源索引里查找, 命中时用get_resources确认资源还在, 顺便清掉已经删除的资源"""
+    store = get_store()
+    res_id = store.find_resource(scope, keys)
+    if res_id is None:
+        return None
+    alive = {r['id'] for r in await res.get_resources()}
+    pruned = store.prune_resources(scope, alive)
+    if pruned:
+        logger.debug(f'资源索引删除了{pruned}个已经不存在的资源')
+    return res_id if res_id in alive else None
+
+async def upload_photo(message: types.Message, bot: AsyncTeleBot) -> int:
+    store = get_store()
+    url = store.get_token(message.chat.id)
+    scope = resource_scope(url)
+    res = Resource(url)
+    photo = message.photo[-1]
+    # 转发或重复发送的图片file_unique_id不变, 不用下载
+    keys = [f'tg:{photo.file_unique_id}']
+    res_id = await find_resource(res, scope, keys)
+    if res_id is not None:
+        logger.info(f'{message.chat.id}.db复用已上传的资源, ResID为{res_id}')
+        return res_id
+
+    file_path = await bot.get_file(photo.file_id)
+    # Bot API下载的文件不超过20MB, 读进内存计算sha256, 内容相同的图片也不再上传
+    content = await bot.download_file(file_path.file_path)
+    digest = f'sha256:{hashlib.sha256(content).hexdigest()}'
+    keys.append(digest)
+    res_id = await find_resource(res, scope, [digest])
+    if res_id is None:
         filename = file_path.file_path.split('/')[1]
-        res_id = await res.upload_resource_by_stream(file_url, filename=filename)
+        res_id = await res.upload_resource_by_content(content, filename=filename)
         logger.info(f'{message.chat.id}.db发送了成功上传资源, ResID为{res_id}')
-        if message.media_group_id is not None:
-            media_ids.setdefault(message.media_group_id, []).append(res_id)
-        else:
-            media_ids.setdefault(message.message_id, []).append(res_id)
-        # markup = types.ForceReply(selective=False)
-        await bot.reply_to(message, f'资源ID：{res_id}')
-    except Exception as e:
+    else:
+        logger.info(f'{message.chat.id}.db复用内容相同的资源, ResID为{res_id}')
+    store.save_resource(scope, keys, res_id)
+    return res_id
+
+async def reply_resources(message: types.Message, bot: AsyncTeleBot, res_ids: list, errors: list):
+    for e in errors:
         logger.error(f'{message.chat.id}.db上传资源出错，{e}')
-        await bot.reply_to(message, f"出错了，重来吧！{e}")
+    if errors and not res_ids:
+        await bot.reply_to(message, f"出错了，重来吧！{errors[0]}")
+    elif errors:
+        await bot.reply_to(message, f'资源ID：{", ".join(map(str, res_ids))}，{len(errors)}张上传失败')
+    else:
+        await bot.reply_to(message, f'资源ID：{", ".join(map(str, res_ids))}')
 
 async def update_edited_memo(message: types.Message, bot: AsyncTeleBot):
-    with shelve.Shelf(dbm.gnu.open(f'db/{message.chat.id}.db', 'c'), protocol=None, writeback=False) as f:
-        if f['token']:
-            url = f['token']
-            memo_id = f[str(message.message_id)]
-        else:
-            await bot.reply_to(message, "未绑定Memos Open API，请先绑定后再使用。")
-            return
-
-    try:
-        memo = Memo(url)
-        # text, tags, visibility, res_ids, status = parse_text(message.text)
-        text, tags, res_ids, visibility, status = parse_html(message.text, message.html_text, message.entities)
-        await memo.update_memo(memo_id, text, visibility, res_ids, status=status)
-        logger.debug(f'\nMemo为: {text}\n Tags为: {tags}\n 公开：{visibility}\n 资源ID：{res_ids}\n 状态: {status}\n')
-        memo_tag = Tag(url)
-        for tag in tags:
-            await memo_tag.create_tag(tag)
-            logger.info(f'{message.chat.id}.db发送了成功创建1个TAG, TAG为{tag}')
+    store = get_store()
+    url = store.get_token(message.chat.id)
+    if not url:
+        await bot.reply_to(message, "未绑定Memos Open API，请先绑定后再使用。")
+        return
+    if store.get_memo_id(message.chat.id, message.message_id) is None:
+        logger.debug(f'{message.chat.id}.db没有找到消息{message.message_id}对应的Memo')
+        return
+    # 连续几次修改只应用最后一次
+    edits.add(message)
+
+async def apply_edit(message: types.Message) -> None:
+    store = get_store()
+    url = store.get_token(message.chat.id)
+    memo_id = store.get_memo_id(message.chat.id, message.message_id)
+    memo = Memo(url)
+    # text, tags, visibility, res_ids, status = parse_text(message.text)
+    text, tags, res_ids, visibility, status = render_markdown(message.text, message.entities)
+    await memo.update_memo(memo_id, text, visibility, res_ids, status=status)
+    logger.debug(f'\nMemo为: {text}\n Tags为: {tags}\n 公开：{visibility}\n 资源ID：{res_ids}\n 状态: {status}\n')
+    submit(message.chat.id, lambda: create_tags(message, url, tags))
+
+async def reply_edit(message: types.Message, bot: AsyncTeleBot, error: Exception | None):
+    if error is None:
         await bot.reply_to(message, '已经更新了')
-    except Exception as e:
-        logger.error(f'{message.chat.id}.db更新Memo失败，更新ID为{memo_id}，{e}')
-        await bot.reply_to(message, f"出错了，重来吧！{e}")
+    else:
+        logger.error(f'{message.chat.id}.db更新Memo失败，消息ID为{message.message_id}，{error}')
+        await bot.reply_to(message, f"出错了，重来吧！{error}")
+
+
+def flush_pending() -> None:
+    """停止前把还在防抖的相册和编辑立即交给调度器"""
+    if media_groups is not None:
+        media_groups.flush()
+    if edits is not None:
+        edits.flush()
 
 
 def register_memo_handlers(bot: AsyncTeleBot):
+    global media_groups, edits
+    media_groups = MediaGroupAggregator(
+        # 上传和应用编辑是最重的Memos请求, 和更新一起受租户并发上限约束
+        upload=lambda m: submit(m.chat.id, lambda: upload_photo(m, bot)),
+        reply=lambda m, res_ids, errors: reply_resources(m, bot, res_ids, errors),
+        debounce=float(os.getenv('MEDIA_GROUP_DEBOUNCE', 1.0))
+    )
+    edits = EditCoalescer(
+        # 应用编辑已经在调度器的后台任务里执行
+        apply=apply_edit,
+        reply=lambda m, error: reply_edit(m, bot, error),
+        debounce=float(os.getenv('EDIT_DEBOUNCE', 1.5))
+    )
     bot.add_custom_filter(ExistDb())
     bot.add_custom_filter(IsReplyFilter())
 
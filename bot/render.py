@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""根据Telegram的message.text和message.entities直接生成Markdown
+
+一次遍历完成格式转换和可见性、发布状态、#RES资源、标签的提取, 不再经过html_text和markdownify.
+entity的offset和length是UTF-16码元, 所以按UTF-16切片.
+输出和markdownify(message.html_text)保持一致: 普通文字里的*和_会转义, 连续空格合并成一个.
+"""
+
+import re
+from typing import List, Tuple
+from loguru import logger
+from telebot.types import MessageEntity
+
+VISIBILITY = ('PRIVATE', 'PROTECTED', 'PUBLIC')
+STATUS = ('NORMAL', 'ARCHIVED')
+
+# 这些entity在html_text里对应一个标签, 其余entity只是普通文字
+MARKUP = {'bold': '**', 'italic': '*', 'strikethrough': '~~', 'code': '`'}
+TAGS = {'pre', 'text_link', 'text_mention', 'underline', 'spoiler', *MARKUP}
+
+whitespace_re = re.compile(r'[\t ]+')
+ASCII_SPACES = str.maketrans('', '', '\x20\x0a\x09\x0c\x0d')
+
+
+class _Node:
+    __slots__ = ('entity', 'type', 'start', 'end', 'children')
+
+    def __init__(self, entity: MessageEntity | None, start: int, end: int):
+        self.entity = entity
+        self.type = entity.type if entity else None
+        self.start = start
+        self.end = end
+        self.children: List[_Node] = []
+
+
+def _escape(text: str) -> str:
+    return text.replace('*', r'\*').replace('_', r'\_')
+
+
+def _chomp(text: str) -> Tuple[str, str, str]:
+    prefix = ' ' if text[:1] == ' ' else ''
+    suffix = ' ' if text[-1:] == ' ' else ''
+    return prefix, suffix, text.strip()
+
+
+def _tree(entities: List[MessageEntity], length: int) -> _Node:
+    """按offset把entity排成嵌套树, 越界的entity截断到父节点内"""
+    root = _Node(None, 0, length)
+    stack = [root]
+    for entity in sorted(entities, key=lambda e: (e.offset, -e.length)):
+        while stack[-1] is not root and entity.offset >= stack[-1].end:
+            stack.pop()
+        parent = stack[-1]
+        node = _Node(entity, entity.offset, min(entity.offset + entity.length, parent.end))
+        parent.children.append(node)
+        stack.append(node)
+    return root
+
+
+def _wrap(node: _Node, text: str) -> str:
+    if node.type in MARKUP:
+        markup = MARKUP[node.type]
+        prefix, suffix, text = _chomp(text)
+        return f'{prefix}{markup}{text}{markup}{suffix}' if text else ''
+    if node.type == 'pre':
+        return f'\n```\n{text}\n```\n' if text else ''
+    if node.type in ('text_link', 'text_mention'):
+        href = node.entity.url if node.type == 'text_link' else f'tg://user?id={node.entity.user.id}'
+        prefix, suffix, text = _chomp(text)
+        if not text:
+            return ''
+        if text.replace(r'\_', '_') == href:
+            return f'<{href}>'
+        return f'{prefix}[{text}]({href}){suffix}' if href else text
+    return text
+
+
+def render_markdown(text: str, entities: List[MessageEntity] | None):
+    """把消息渲染成Markdown, 同时提取控制标签
+
+    Args:
+        text (str): message.text
+        entities (List[MessageEntity] | None): message.entities
+
+    Returns:
+        tuple: 和parse_html一样的5元组
+            text (str): Markdown文本, 可见性、发布状态和#RES标签已去掉
+            tags (list): tag列表
+            res_ids (list): 资源列表
+            visibility (str): 可见性, 默认为PRIVATE
+            status (str): 发布状态, 默认为NORMAL
+    """
+    visibility = 'PRIVATE'
+    status = 'NORMAL'
+    tags = []
+    res_ids = []
+    text = text or ''
+    if not entities:
+        return _escape(whitespace_re.sub(' ', text)), tags, res_ids, visibility, status
+
+    data = text.encode('utf-16-le')
+
+    def piece(start: int, end: int) -> str:
+        return data[start * 2:end * 2].decode('utf-16-le') if end > start else ''
+
+    def hashtag(t: str) -> bool:
+        """记录标签, 返回True表示这是控制标签, 不写进正文"""
+        nonlocal visibility, status
+        name = t.strip('#')
+        if name in VISIBILITY:
+            logger.debug(f'发现可见性状态:{t}')
+            visibility = name
+        elif name in STATUS:
+            logger.debug(f'发现发布状态:{t}')
+            status = name
+        elif t.startswith('#RES') and t[4:].isdigit():
+            logger.debug(f'发现资源:{t}')
+            res_ids.append(int(t[4:]))
+        else:
+            logger.debug(f'发现标签:{t}')
+            tags.append(name)
+            return False
+        return True
+
+    def render(node: _Node) -> str:
+        out = []
+        buf = []
+
+        def flush() -> None:
+            s = ''.join(buf)
+            buf.clear()
+            if s:
+                if node.type != 'pre':
+                    # 和BeautifulSoup一样, 标签之间只有空白的文字缩成一个换行或空格
+                    if not s.translate(ASCII_SPACES):
+                        s = '\n' if '\n' in s else ' '
+                    s = whitespace_re.sub(' ', s)
+                if node.type not in ('code', 'pre'):
+                    s = _escape(s)
+                out.append(s)
+
+        def walk(parent: _Node) -> None:
+            # 没有对应html标签的entity当作普通文字, 和两边的文字合并后再处理空格
+            pos = parent.start
+            for child in parent.children:
+                buf.append(piece(pos, child.start))
+                pos = child.end
+                if child.type == 'hashtag' and hashtag(piece(child.start, child.end)):
+                    continue
+                if child.type in TAGS:
+                    flush()
+                    out.append(_wrap(child, render(child)))
+                else:
+                    walk(child)
+            buf.append(piece(pos, parent.end))
+
+        walk(node)
+        flush()
+        return ''.join(out)
+
+    return render(_tree(entities, len(data) // 2)), tags, res_ids, visibility, status
@@ -3,32 +3,83 @@ import asyncio
 
 from pathlib import Path
 from aiohttp import web
-from telebot.async_telebot import AsyncTeleBot, types
+from telebot.async_telebot import AsyncTeleBot
 from dotenv import load_dotenv
 from loguru import logger
 from bot.auth import register_auth_handlers
-from bot.memo import register_memo_handlers
+from bot.memo import flush_pending, register_memo_handlers
+from bot.dispatch import UpdateDispatcher, decode_update, tenant_of
+from bot.store import get_store
+from memos.memosapi import close_sessions, host_policies, memo_cache
+from memos.metrics import request_metrics
 
 
-load_dotenv(Path('.env'))
-bot = AsyncTeleBot(os.getenv('API_TOKEN'))
+bot: AsyncTeleBot | None = None
+
+
+def create_bot() -> AsyncTeleBot:
+    """读取.env并创建bot、注册handler, 在main里调用, 导入模块时不做任何事
+    """
+    global bot
+    if bot is None:
+        load_dotenv(Path('.env'))
+        bot = AsyncTeleBot(os.getenv('API_TOKEN'))
+        register_auth_handlers(bot)
+        register_memo_handlers(bot)
+    return bot
 
-register_auth_handlers(bot)
-register_memo_handlers(bot)
 #Process webhook calls
 async def handle(request):
     if request.match_info.get('token') == bot.token:
-        request_body_dict = await request.json()
-        update = types.Update.de_json(request_body_dict)
-        asyncio.ensure_future(bot.process_new_updates([update]))
-        return web.Response()
+        update = decode_update(await request.read())
+        if request.app['dispatcher'].put(update):
+            return web.Response()
+        # 队列满了, Telegram收到非2xx会重试
+        return web.Response(status=503)
     else:
         return web.Response(status=403)
 
 
+async def healthz(request):
+    return web.json_response({**request.app['dispatcher'].stats(), 'memo_cache': memo_cache.stats(), 'hosts': host_policies.stats()})
+
+
+async def metrics(request):
+    return web.Response(text=request_metrics.prometheus() + request.app['dispatcher'].prometheus() + memo_cache.prometheus() + host_policies.prometheus(), content_type='text/plain', charset='utf-8')
+
+
+async def start_dispatcher(app):
+    app['dispatcher'].start()
+
+
+async def start_monitoring(app):
+    """healthz和metrics包含所有租户的主机和熔断状态, 只在单独的本机端口上提供, 不放在公开的webhook端口上
+    """
+    port = os.getenv('METRICS_PORT', '9091')
+    if not port:
+        return
+    monitoring = web.Application()
+    monitoring['dispatcher'] = app['dispatcher']
+    monitoring.router.add_get('/healthz', healthz)
+    monitoring.router.add_get('/metrics', metrics)
+    runner = web.AppRunner(monitoring)
+    await runner.setup()
+    await web.TCPSite(runner, os.getenv('METRICS_LISTEN', '127.0.0.1'), int(port)).start()
+    app['monitoring'] = runner
+
+
+async def stop_monitoring(app):
+    if 'monitoring' in app:
+        await app['monitoring'].cleanup()
+
+
 async def shutdown(app):
+    # 还在防抖的相册和编辑先立即提交, 再等已经接受的更新和后台任务处理完, 最后关闭bot和连接池
+    flush_pending()
+    await app['dispatcher'].stop(timeout=float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 30)))
     await bot.remove_webhook()
     await bot.close_session()
+    await close_sessions()
 
 async def setup():
     # Remove webhook, it fails sometimes the set if there is a previous webhook
@@ -42,11 +93,30 @@ async def setup():
     await bot.set_webhook(url=url)
 
     app = web.Application()
+    app['dispatcher'] = UpdateDispatcher(
+        bot.process_new_updates,
+        workers=int(os.getenv('WEBHOOK_WORKERS', 8)),
+        maxsize=int(os.getenv('WEBHOOK_QUEUE_SIZE', 256)),
+        tenant=lambda chat_id: tenant_of(get_store().get_token(chat_id)),
+        tenant_concurrency=int(os.getenv('WEBHOOK_TENANT_CONCURRENCY', 2)),
+        tenant_maxsize=int(os.getenv('WEBHOOK_TENANT_QUEUE_SIZE', 64))
+    )
     app.router.add_post('/{token}/', handle)
+    app.on_startup.append(start_dispatcher)
+    app.on_startup.append(start_monitoring)
+    app.on_cleanup.append(stop_monitoring)
     app.on_cleanup.append(shutdown)
     return app
 
+async def polling():
+    try:
+        await bot.remove_webhook()
+        await bot.infinity_polling()
+    finally:
+        await close_sessions()
+
 def main():
+    create_bot()
     mode = os.getenv('MODE', default='polling')
     if mode == 'webhook':
         logger.debug(f'webhook模式')
@@ -57,9 +127,8 @@ def main():
             port=os.getenv('WEBHOOK_PORT')
         )
     elif mode == 'polling':
-        asyncio.run(bot.remove_webhook())
         logger.debug(f'polling模式')
-        asyncio.run(bot.infinity_polling())
+        asyncio.run(polling())
     else:
         pass
 
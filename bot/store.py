@@ -0,0 +1,172 @@
+import hashlib
+import os
+import shelve
+import sqlite3
+import time
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, List
+from urllib.parse import urlparse
+from loguru import logger
+
+
+def resource_scope(token: str) -> str:
+    """资源索引的范围, 资源属于某个主机上的某个用户, 所以按主机加Open API的摘要区分, 不保存token本身"""
+    return f'{urlparse(token).netloc}/{hashlib.sha256(token.encode()).hexdigest()[:16]}'
+
+
+class StateStore:
+    """bot的状态存储, 单个SQLite文件(WAL)保存chat绑定的token、message_id到memo_id的映射和资源去重索引
+
+    token读取走内存LRU, 每条消息不再打开文件.
+    资源索引把Telegram的file_unique_id和文件sha256映射到已上传的资源id, 超过resource_index_size条时淘汰最久没用过的.
+    """
+    def __init__(self, path: str = 'db/state.sqlite3', cache_size: int = 1024,
+                 resource_index_size: int = 10000):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS binding (chat_id INTEGER PRIMARY KEY, token TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS message ('
+                          'chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, memo_id INTEGER NOT NULL, '
+                          'PRIMARY KEY (chat_id, message_id))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS resource_index ('
+                          'scope TEXT NOT NULL, key TEXT NOT NULL, resource_id INTEGER NOT NULL, used_at REAL NOT NULL, '
+                          'PRIMARY KEY (scope, key))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS resource_index_used_at ON resource_index (used_at)')
+        self.cache_size = cache_size
+        self.resource_index_size = resource_index_size
+        self._tokens: OrderedDict[int, str | None] = OrderedDict()
+
+    def _remember(self, chat_id: int, token: str | None) -> None:
+        self._tokens[chat_id] = token
+        self._tokens.move_to_end(chat_id)
+        while len(self._tokens) > self.cache_size:
+            self._tokens.popitem(last=False)
+
+    def get_token(self, chat_id: int) -> str | None:
+        """获取chat绑定的Memos Open API, 未绑定返回None
+        """
+        if chat_id in self._tokens:
+            self._tokens.move_to_end(chat_id)
+            return self._tokens[chat_id]
+        row = self.conn.execute('SELECT token FROM binding WHERE chat_id = ?', (chat_id,)).fetchone()
+        token = row[0] if row else None
+        self._remember(chat_id, token)
+        return token
+
+    def bind(self, chat_id: int, token: str) -> None:
+        self.conn.execute('INSERT OR REPLACE INTO binding (chat_id, token) VALUES (?, ?)', (chat_id, token))
+        self._remember(chat_id, token)
+
+    def unbind(self, chat_id: int) -> bool:
+        """解绑并删除该chat的消息映射, 没有绑定信息时返回False
+        """
+        token = self.get_token(chat_id)
+        if token:
+            self.conn.execute('DELETE FROM resource_index WHERE scope = ?', (resource_scope(token),))
+        cursor = self.conn.execute('DELETE FROM binding WHERE chat_id = ?', (chat_id,))
+        self.conn.execute('DELETE FROM message WHERE chat_id = ?', (chat_id,))
+        self._remember(chat_id, None)
+        return cursor.rowcount > 0
+
+    def save_message(self, chat_id: int, message_id: int, memo_id: int) -> None:
+        self.conn.execute('INSERT OR REPLACE INTO message (chat_id, message_id, memo_id) VALUES (?, ?, ?)',
+                          (chat_id, message_id, memo_id))
+
+    def get_memo_id(self, chat_id: int, message_id: int) -> int | None:
+        row = self.conn.execute('SELECT memo_id FROM message WHERE chat_id = ? AND message_id = ?',
+                                (chat_id, message_id)).fetchone()
+        return row[0] if row else None
+
+    def find_resource(self, scope: str, keys: List[str]) -> int | None:
+        """按顺序查找keys, 返回第一个命中的资源id并更新使用时间
+        """
+        for key in keys:
+            row = self.conn.execute('SELECT resource_id FROM resource_index WHERE scope = ? AND key = ?',
+                                    (scope, key)).fetchone()
+            if row:
+                self.conn.execute('UPDATE resource_index SET used_at = ? WHERE scope = ? AND key = ?',
+                                  (time.time(), scope, key))
+                return row[0]
+        return None
+
+    def save_resource(self, scope: str, keys: List[str], resource_id: int) -> None:
+        now = time.time()
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('INSERT OR REPLACE INTO resource_index (scope, key, resource_id, used_at) VALUES (?, ?, ?, ?)',
+                                  [(scope, key, resource_id, now) for key in keys])
+            overflow = self.conn.execute('SELECT COUNT(*) FROM resource_index').fetchone()[0] - self.resource_index_size
+            if overflow > 0:
+                self.conn.execute('DELETE FROM resource_index WHERE rowid IN '
+                                  '(SELECT rowid FROM resource_index ORDER BY used_at LIMIT ?)', (overflow,))
+
+    def prune_resources(self, scope: str, alive: Iterable[int]) -> int:
+        """删除索引里已经不在Memos上的资源, 返回删除的条数
+
+        Args:
+            scope (str): 资源索引范围
+            alive (Iterable[int]): Memos上现有的资源id
+        """
+        alive = set(alive)
+        indexed = [row[0] for row in self.conn.execute('SELECT DISTINCT resource_id FROM resource_index WHERE scope = ?', (scope,))]
+        gone = [(scope, res_id) for res_id in indexed if res_id not in alive]
+        if gone:
+            self.conn.executemany('DELETE FROM resource_index WHERE scope = ? AND resource_id = ?', gone)
+        return len(gone)
+
+    def migrate(self, db_dir: str = 'db') -> int:
+        """把旧的db/<chat_id>.db迁移进来, 迁移后的文件改名为.db.migrated, 只会执行一次
+
+        Args:
+            db_dir (str, optional): 旧配置文件目录. Defaults to 'db'.
+
+        Returns:
+            int: 迁移的chat数量
+        """
+        old_files = [p for p in Path(db_dir).glob('*.db') if p.stem.lstrip('-').isdigit()]
+        if not old_files:
+            return 0
+        import dbm.gnu
+
+        count = 0
+        for p in old_files:
+            chat_id = int(p.stem)
+            try:
+                with shelve.Shelf(dbm.gnu.open(str(p), 'r'), protocol=None) as f:
+                    rows = [(chat_id, int(k), f[k]) for k in f.keys() if k.isdigit()]
+                    token = f.get('token')
+            except Exception as e:
+                logger.error(f'{p.name}迁移失败，{e}')
+                continue
+            with self.conn:
+                self.conn.execute('BEGIN')
+                if token:
+                    self.conn.execute('INSERT OR REPLACE INTO binding (chat_id, token) VALUES (?, ?)', (chat_id, token))
+                self.conn.executemany('INSERT OR IGNORE INTO message (chat_id, message_id, memo_id) VALUES (?, ?, ?)', rows)
+            self._tokens.pop(chat_id, None)
+            p.rename(p.with_name(f'{p.name}.migrated'))
+            count += 1
+            logger.info(f'{p.name}已经迁移，{len(rows)}条消息记录')
+        return count
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+_store: StateStore | None = None
+
+
+def get_store() -> StateStore:
+    """进程内共享的StateStore, 第一次使用时打开并迁移旧配置文件
+    """
+    global _store
+    if _store is None:
+        # 调用时才读环境变量, 这时.env已经加载
+        _store = StateStore(os.getenv('STATE_DB', 'db/state.sqlite3'),
+                            resource_index_size=int(os.getenv('RESOURCE_INDEX_SIZE', 10000)))
+        _store.migrate(os.getenv('STATE_DB_DIR', 'db'))
+    return _store
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import asyncio
+import copy
+import json
+import time
+
+from pathlib import Path
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Tuple
+from loguru import logger
+
+
+class RateLimiter:
+    """按每秒请求数限速, rate小于等于0时不限速
+    """
+    def __init__(self, rate: float = 0):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BulkReport:
+    """批量操作的结果, 可以写入文件用于断点续跑
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.succeeded: List[Any] = []
+        self.failed: Dict[Any, str] = {}
+        self.skipped = 0
+        self.resumed: set = set()
+        # 读取条目(例如分页请求)出错时的异常, 这时只处理了一部分条目
+        self.error: str | None = None
+        self.started = time.monotonic()
+
+    def summary(self) -> dict:
+        summary = {
+            'name': self.name,
+            'succeeded': len(self.succeeded),
+            'failed': len(self.failed),
+            'skipped': self.skipped,
+            'seconds': round(time.monotonic() - self.started, 2)
+        }
+        if self.error is not None:
+            summary['error'] = self.error
+        return summary
+
+    def save(self, path: str | Path) -> None:
+        data = {
+            **self.summary(),
+            'succeeded_keys': list(self.resumed) + self.succeeded,
+            'failed_keys': [{'key': k, 'error': e} for k, e in self.failed.items()]
+        }
+        Path(path).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    @staticmethod
+    def load_succeeded(path: str | Path) -> set:
+        """读取上一次报告里已经成功的key, 文件不存在时返回空集合
+        """
+        if not Path(path).exists():
+            return set()
+        data = json.loads(Path(path).read_text(encoding='utf-8'))
+        return set(data.get('succeeded_keys', []))
+
+
+async def _aiter(items: Iterable | AsyncIterable):
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class BulkExecutor:
+    """带并发上限、限速、单条重试和进度汇报的批量执行器
+
+    Args:
+        concurrency (int, optional): 同时执行的最大请求数. Defaults to 8.
+        rate (float, optional): 每秒最多发起的请求数, 0为不限速. Defaults to 0.
+        retries (int, optional): 单条失败后的重试次数. Defaults to 2.
+        report (str, optional): 结果报告写入的文件. Defaults to None.
+        resume (str, optional): 上一次的报告文件, 已成功的条目会跳过. Defaults to None.
+    """
+    def __init__(self,
+                 concurrency: int = 8,
+                 rate: float = 0,
+                 retries: int = 2,
+                 report: str = None,
+                 resume: str = None):
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rate)
+        self.retries = max(0, retries)
+        self.report = report
+        self.resume = resume
+        self.retry_on: Tuple[type, ...] = (Exception,)
+
+    def only_retrying(self, *exceptions: type) -> 'BulkExecutor':
+        """返回共用并发、限速和报告配置的执行器, 只在出现这些异常时重试, 用于不能重复执行的写操作
+        """
+        executor = copy.copy(self)
+        executor.retry_on = exceptions
+        return executor
+
+    async def _call(self, func: Callable[[Any], Awaitable], item: Any) -> None:
+        for attempt in range(self.retries + 1):
+            await self.limiter.wait()
+            try:
+                await func(item)
+                return
+            except self.retry_on:
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def run(self,
+                  name: str,
+                  items: Iterable | AsyncIterable,
+                  func: Callable[[Any], Awaitable],
+                  key: Callable[[Any], Any] = lambda x: x) -> BulkReport:
+        """对items逐条执行func, items可以是异步迭代器, 边产生边执行
+
+        Args:
+            name (str): 操作名, 用于日志和报告
+            items (Iterable | AsyncIterable): 待处理的条目
+            func (Callable[[Any], Awaitable]): 处理单条的协程函数
+            key (Callable[[Any], Any], optional): 条目的唯一标识, 用于报告和续跑. Defaults to lambda x: x.
+
+        Returns:
+            BulkReport: 执行结果
+        """
+        report = BulkReport(name)
+        if self.resume:
+            report.resumed = BulkReport.load_succeeded(self.resume)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        last_log = time.monotonic()
+
+        async def worker(item: Any) -> None:
+            nonlocal last_log
+            k = key(item)
+            try:
+                await self._call(func, item)
+                report.succeeded.append(k)
+            except Exception as e:
+                logger.error(f'{name}处理{k}失败，{e!r}')
+                report.failed[k] = repr(e)
+            finally:
+                semaphore.release()
+            if time.monotonic() - last_log >= 1:
+                last_log = time.monotonic()
+                logger.info(f'{name}进度：成功{len(report.succeeded)}个，失败{len(report.failed)}个')
+
+        try:
+            async for item in _aiter(items):
+                if key(item) in report.resumed:
+                    report.skipped += 1
+                    continue
+                await semaphore.acquire()
+                task = asyncio.create_task(worker(item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except Exception as e:
+            # 已经开始的条目照常完成并写入报告, 续跑时可以跳过
+            report.error = repr(e)
+            logger.error(f'{name}读取条目出错，等待已开始的条目完成后退出，{e!r}')
+            raise
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f'{name}完成：{report.summary()}')
+            if self.report:
+                report.save(self.report)
+        return report
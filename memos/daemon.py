@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""常驻的CLI守护进程, 在Unix socket上执行memo、tag、resource命令
+
+守护进程只导入一次memosapi, 命令都在同一个事件循环里执行, 连接池、tag缓存和memo缓存在命令之间保留.
+app.py发现socket存在时把命令行交给守护进程, 原样输出结果; 守护进程没有运行时在本进程执行.
+本模块只导入几个轻量的标准库, 转发命令时不会导入asyncio、aiohttp等依赖, 服务端在daemon_server.py.
+"""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+
+from pathlib import Path
+
+# 可以交给守护进程执行的命令组
+DAEMON_GROUPS = ('memo', 'tag', 'resource')
+SOCKET_PATH = os.getenv('MEMOS_DAEMON_SOCKET') or str(Path(tempfile.gettempdir()) / f'memos-bot-{os.getuid() if hasattr(os, "getuid") else 0}.sock')
+
+
+def _send(path: str, message: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+        s.shutdown(socket.SHUT_WR)
+        chunks = []
+        while chunk := s.recv(65536):
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks))
+
+
+def forward(group: str, argv: list, path: str = None) -> int | None:
+    """把一条命令交给守护进程执行, 并输出结果
+
+    只有连接失败时才返回None, 由调用方在本进程执行; 连上之后出错不会回退, 避免同一条写操作执行两次.
+
+    Args:
+        group (str): 命令组
+        argv (list): 命令组之后的参数
+        path (str, optional): socket路径. Defaults to SOCKET_PATH.
+
+    Returns:
+        int | None: 命令的退出码, 守护进程没有运行时为None
+    """
+    path = path or SOCKET_PATH
+    if group not in DAEMON_GROUPS or not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    # 和本进程执行时一样从.env读取OPEN_API, 已经设置的环境变量优先
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    message = {'op': 'run', 'group': group, 'argv': list(argv), 'cwd': os.getcwd(),
+               'open_api': os.getenv('OPEN_API')}
+    try:
+        reply = _send(path, message)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # 守护进程已经退出, 留下了socket文件
+        return None
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    return reply['code']
+
+
+class Daemon:
+    """管理守护进程
+
+    Args:
+        socket (str, optional): Unix socket路径, 默认为环境变量MEMOS_DAEMON_SOCKET或临时目录下的memos-bot-<uid>.sock. Defaults to None.
+    """
+    def __init__(self, socket: str = None):
+        self.path = socket or SOCKET_PATH
+
+    def start(self, idle_timeout: float = 0) -> None:
+        """在前台运行守护进程, 可以用nohup或systemd放到后台
+
+        Args:
+            idle_timeout (float, optional): 这么多秒没有命令就退出, 0为一直运行. Defaults to 0.
+        """
+        if os.path.exists(self.path):
+            try:
+                _send(self.path, {'op': 'status'})
+                print(f'守护进程已经在运行，socket={self.path}')
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                os.unlink(self.path)
+        from memos.daemon_server import DaemonServer
+
+        DaemonServer(self.path).run(idle_timeout)
+
+    def stop(self) -> dict | None:
+        """停止守护进程"""
+        try:
+            return _send(self.path, {'op': 'stop'})
+        except (FileNotFoundError, ConnectionRefusedError):
+            print('守护进程没有运行')
+
+    def status(self) -> dict | None:
+        """守护进程的pid、运行时间、执行过的命令数和各主机的状态"""
+        try:
+            return _send(self.path, {'op': 'status'})
+        except (FileNotFoundError, ConnectionRefusedError):
+            print('守护进程没有运行')
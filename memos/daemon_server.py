@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""守护进程的服务端, 由`app.py daemon start`启动
+
+命令在同一个线程的同一个事件循环里串行执行, memosapi的连接池按事件循环复用, 所以在命令之间保持连接.
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DaemonServer:
+    """在Unix socket上接收命令, 用一个线程和它的事件循环串行执行
+
+    Args:
+        path (str): Unix socket路径
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.monotonic()
+        self.calls = 0
+        # 和本进程执行时一样先加载.env, 再记下守护进程自己的OPEN_API
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        self._env_token = os.getenv('OPEN_API')
+        self._token_set = False
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _init_worker(self) -> None:
+        # 命令都在这个线程的事件循环里执行, Fire的run_until_complete会用它, 连接池不会随命令关闭
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+    def _run(self, group: str, argv: list, cwd: str, open_api: str | None) -> dict:
+        from fire import Fire
+        from memos import memosapi
+        from memos.records import plain
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        code = 0
+        # 每条命令使用客户端的工作目录和OPEN_API, 命令串行执行, 可以直接修改进程状态
+        os.chdir(cwd)
+        token = open_api or self._env_token
+        if token:
+            os.environ['OPEN_API'] = token
+            self._token_set = self._env_token is None
+        elif self._token_set:
+            # 只删除之前的命令设置的OPEN_API
+            os.environ.pop('OPEN_API', None)
+            self._token_set = False
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                Fire(getattr(memosapi, group.capitalize()), command=argv, name=f'app.py {group}', serialize=plain)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                code = 1
+        self.calls += 1
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'code': code}
+
+    def _status(self) -> dict:
+        status = {'pid': os.getpid(), 'socket': self.path, 'uptime': round(time.monotonic() - self.started, 1),
+                  'calls': self.calls}
+        if 'memos.memosapi' in sys.modules:
+            from memos.memosapi import host_policies, memo_cache
+            status['hosts'] = host_policies.stats()
+            status['memo_cache'] = memo_cache.stats()
+        return status
+
+    async def _serve(self, idle_timeout: float) -> None:
+        executor = ThreadPoolExecutor(max_workers=1, initializer=self._init_worker)
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        last_call = time.monotonic()
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            nonlocal last_call
+            try:
+                message = json.loads(await reader.readline())
+                if message['op'] == 'run':
+                    reply = await loop.run_in_executor(executor, self._run, message['group'], message['argv'],
+                                                       message['cwd'], message.get('open_api'))
+                    last_call = time.monotonic()
+                elif message['op'] == 'status':
+                    reply = self._status()
+                elif message['op'] == 'stop':
+                    reply = {'stopped': True}
+                    stopped.set()
+                else:
+                    reply = {'stdout': '', 'stderr': f'未知操作{message["op"]}\n', 'code': 2}
+                writer.write(json.dumps(reply, ensure_ascii=False).encode('utf-8'))
+                await writer.drain()
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(handle, path=self.path, limit=2 ** 20)
+        os.chmod(self.path, 0o600)
+        print(f'守护进程已启动，pid={os.getpid()}，socket={self.path}', flush=True)
+        try:
+            while not stopped.is_set():
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stopped.wait(), timeout=1)
+                if idle_timeout > 0 and time.monotonic() - last_call > idle_timeout:
+                    break
+        finally:
+            server.close()
+            await server.wait_closed()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+            if self._loop is not None:
+                await loop.run_in_executor(executor, self._close_worker)
+            executor.shutdown()
+
+    def _close_worker(self) -> None:
+        from memos.memosapi import host_policies, sessions
+
+        host_policies.reset()
+        sessions.close_all()
+        self._loop.close()
+
+    def run(self, idle_timeout: float = 0) -> None:
+        # 先导入, 第一条命令不用等
+        import fire
+        import memos.memosapi
+
+        asyncio.run(self._serve(idle_timeout))
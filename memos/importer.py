@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""从Markdown目录或JSONL文件批量导入memo
+
+读取、上传图片、创建memo三个阶段串成流水线, 阶段之间有界, 不会把整个目录读进内存.
+每上传一个资源、创建一条memo都追加一行到检查点文件, 中断后重新运行会跳过已完成的部分.
+同一个本地文件只上传一次, 引用它的memo共用一个资源.
+"""
+
+import asyncio
+import json
+import mimetypes
+import re
+
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Tuple
+from aiohttp import ClientConnectorError
+from loguru import logger
+from memos.bulk import BulkExecutor, BulkReport
+from memos.memosapi import Memo, Resource, Tag, VISIBILITY
+from memos.rename import find_tags
+from memos.resilience import CircuitOpenError
+
+# ![alt](path "title") 和 ![[path|alt]]
+IMAGE_PATTERN = re.compile(r'!\[[^\]]*\]\(\s*<?([^)\s>]+)>?(?:\s+"[^"]*")?\s*\)|!\[\[([^\]|]+)(?:\|[^\]]*)?\]\]')
+
+
+class ImportItem:
+    """一条待导入的memo
+
+    Args:
+        key (str): 在来源里的唯一标识, 用于检查点
+        content (str): memo内容, 本地图片引用会被去掉, 改为资源附件
+        visibility (VISIBILITY): 可见性
+        images (List[Path]): 需要上传的本地文件
+    """
+    __slots__ = ('key', 'content', 'visibility', 'images', 'res_ids')
+
+    def __init__(self, key: str, content: str, visibility: VISIBILITY, images: List[Path]):
+        self.key = key
+        self.content = content
+        self.visibility = visibility
+        self.images = images
+        self.res_ids: List[int] = []
+
+
+def extract_images(content: str, base: Path) -> Tuple[str, List[Path]]:
+    """找出引用本地文件的图片, 返回去掉这些引用后的内容和文件列表, 远程图片和找不到的文件保持原样
+    """
+    images = []
+
+    def replace(match: re.Match) -> str:
+        target = match.group(1) or match.group(2)
+        if '://' in target or target.startswith('data:'):
+            return match.group(0)
+        path = (base / target.strip()).resolve()
+        if not path.is_file():
+            logger.warning(f'找不到图片{target}，保留原文')
+            return match.group(0)
+        if path not in images:
+            images.append(path)
+        return ''
+
+    return IMAGE_PATTERN.sub(replace, content).strip(), images
+
+
+def read_markdown(root: Path, visibility: VISIBILITY) -> Iterator[ImportItem]:
+    for path in sorted(root.rglob('*.md')):
+        content, images = extract_images(path.read_text(encoding='utf-8'), path.parent)
+        yield ImportItem(path.relative_to(root).as_posix(), content, visibility, images)
+
+
+def read_jsonl(path: Path, visibility: VISIBILITY) -> Iterator[ImportItem]:
+    """每行一个json对象, content必填, 可选id、visibility和resources(相对于jsonl文件的本地路径)
+    """
+    with path.open(encoding='utf-8') as f:
+        for lineno, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            content, images = extract_images(data['content'], path.parent)
+            for res in data.get('resources') or []:
+                res_path = (path.parent / res).resolve()
+                if res_path not in images:
+                    images.append(res_path)
+            yield ImportItem(str(data.get('id', lineno)), content, data.get('visibility') or visibility, images)
+
+
+class Checkpoint:
+    """追加写的检查点文件, 每行记录一个已上传的资源或已创建的memo
+    """
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.memos: Dict[str, int] = {}
+        self.resources: Dict[str, int] = {}
+        if self.path.exists():
+            with self.path.open(encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    # 最后一行可能在中断时只写了一半
+                    try:
+                        data = json.loads(line)
+                    except ValueError:
+                        continue
+                    if 'memo_id' in data:
+                        self.memos[data['key']] = data['memo_id']
+                    else:
+                        self.resources[data['path']] = data['resource_id']
+        self._file = self.path.open('a', encoding='utf-8')
+
+    def _write(self, data: dict) -> None:
+        self._file.write(json.dumps(data, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def add_resource(self, path: Path, resource_id: int) -> None:
+        self.resources[str(path)] = resource_id
+        self._write({'path': str(path), 'resource_id': resource_id})
+
+    def add_memo(self, key: str, memo_id: int) -> None:
+        self.memos[key] = memo_id
+        self._write({'key': key, 'memo_id': memo_id})
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class Importer:
+    """导入流水线: 读取 -> 上传资源 -> 创建memo
+
+    Args:
+        token (str): Memos Open API
+        executor (BulkExecutor): 创建memo阶段使用的执行器, 控制并发、限速和重试, 只重试请求没有到达服务器的错误
+        upload_concurrency (int, optional): 同时上传的资源数. Defaults to 4.
+    """
+    def __init__(self, token: str, executor: BulkExecutor, upload_concurrency: int = 4):
+        self.memo = Memo(token)
+        self.res = Resource(token)
+        self.tag = Tag(token)
+        # 超时或服务器出错时memo可能已经创建, 重试会产生重复的memo
+        self.executor = executor.only_retrying(ClientConnectorError, CircuitOpenError)
+        self.upload_concurrency = max(1, upload_concurrency)
+
+    async def _upload(self, item: ImportItem, checkpoint: Checkpoint, semaphore: asyncio.Semaphore,
+                      uploads: Dict[str, asyncio.Task]) -> ImportItem:
+        async def upload(path: Path) -> int:
+            async with semaphore:
+                content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+                res_id = await self.res.upload_resource(path, filename=path.name, content_type=content_type)
+            checkpoint.add_resource(path, res_id)
+            return res_id
+
+        async def one(path: Path) -> int:
+            res_id = checkpoint.resources.get(str(path))
+            if res_id is not None:
+                return res_id
+            # 多条memo引用同一个文件时只上传一次
+            task = uploads.get(str(path))
+            if task is None:
+                task = uploads[str(path)] = asyncio.create_task(upload(path))
+            try:
+                return await asyncio.shield(task)
+            except Exception:
+                uploads.pop(str(path), None)
+                raise
+
+        item.res_ids = list(await asyncio.gather(*[one(path) for path in item.images]))
+        return item
+
+    async def _uploaded(self,
+                        items: Iterator[ImportItem],
+                        checkpoint: Checkpoint,
+                        report: BulkReport,
+                        tags: set) -> AsyncIterator[ImportItem]:
+        """上传阶段, 最多upload_concurrency条memo同时在上传, 上传完的按完成顺序交给下一阶段
+
+        跳过的memo也会收集tag, 续跑时上一次没建成的tag会补上.
+        """
+        semaphore = asyncio.Semaphore(self.upload_concurrency)
+        uploads: Dict[str, asyncio.Task] = {}
+        pending = set()
+        seen = set()
+
+        async def drain(return_when: str) -> AsyncIterator[ImportItem]:
+            nonlocal pending
+            done, pending = await asyncio.wait(pending, return_when=return_when)
+            for task in done:
+                key = task.get_name()
+                try:
+                    yield task.result()
+                except Exception as e:
+                    logger.error(f'导入{key}上传资源失败，{e!r}')
+                    report.failed[key] = repr(e)
+
+        for item in items:
+            tags.update(find_tags(item.content))
+            if item.key in checkpoint.memos or item.key in seen:
+                report.skipped += 1
+                continue
+            seen.add(item.key)
+            pending.add(asyncio.create_task(self._upload(item, checkpoint, semaphore, uploads), name=item.key))
+            if len(pending) >= self.upload_concurrency:
+                async for done in drain(asyncio.FIRST_COMPLETED):
+                    yield done
+        while pending:
+            async for done in drain(asyncio.ALL_COMPLETED):
+                yield done
+
+    async def run(self, source: str | Path, visibility: VISIBILITY = 'PRIVATE', checkpoint: str | Path = None) -> dict:
+        """导入source, 目录按Markdown读取, 文件按JSONL读取
+
+        Args:
+            source (str | Path): Markdown目录或JSONL文件
+            visibility (VISIBILITY, optional): 默认可见性. Defaults to 'PRIVATE'.
+            checkpoint (str | Path, optional): 检查点文件, 默认为source旁边的<source>.import.jsonl. Defaults to None.
+
+        Returns:
+            dict: 执行汇总
+        """
+        source = Path(source)
+        if source.is_dir():
+            items = read_markdown(source, visibility)
+        elif source.is_file():
+            items = read_jsonl(source, visibility)
+        else:
+            raise ValueError(source)
+        checkpoint = Checkpoint(checkpoint or f'{source.resolve()}.import.jsonl')
+        upload_report = BulkReport('import_upload')
+        tags = set()
+
+        async def create(item: ImportItem) -> None:
+            memo_id = await self.memo.send_memo(text=item.content, visibility=item.visibility, res_ids=item.res_ids)
+            checkpoint.add_memo(item.key, memo_id)
+
+        try:
+            report = await self.executor.run('import', self._uploaded(items, checkpoint, upload_report, tags), create, key=lambda x: x.key)
+        finally:
+            checkpoint.close()
+        if tags:
+            try:
+                await self.tag.ensure_tags(sorted(tags))
+            except Exception as e:
+                logger.error(f'导入后创建TAG出错，{e!r}')
+        summary = report.summary()
+        summary['failed'] += len(upload_report.failed)
+        summary['skipped'] += upload_report.skipped
+        summary['checkpoint'] = str(checkpoint.path)
+        return summary
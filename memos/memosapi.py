@@ -3,43 +3,298 @@
 
 import asyncio
 import os
+import time
 
+from collections import OrderedDict, defaultdict
 from pathlib import Path
-from typing import List, Dict, Literal
+from typing import Any, AsyncIterator, Callable, List, Dict, Literal, Tuple
 from urllib.parse import urlparse
 from aiohttp.formdata import FormData
-from aiohttp import ClientResponse, ClientTimeout
-from aiohttp_retry import RetryClient, ClientSession
+from aiohttp import ClientConnectionError, ClientResponse, ClientTimeout, TCPConnector
+from aiohttp_retry import RetryClient, ClientSession, ExponentialRetry
 from loguru import logger
 from dotenv import load_dotenv
+from memos.bulk import BulkExecutor
+from memos.metrics import request_metrics
+from memos.records import MemoRecord, ResourceRecord, json_loads, memo_records, resource_records
+from memos.resilience import HostPolicies
 
 
 load_dotenv()
+
+
+class SessionManager:
+    """按scheme+netloc复用ClientSession, 同一个Memos主机的请求共享连接池
+
+    每个主机一个TCPConnector, 保持长连接、缓存DNS并限制单主机连接数,
+    进程退出前需要调用close/close_all关闭.
+    """
+    def __init__(self,
+                 limit_per_host: int = int(os.getenv('MEMOS_LIMIT_PER_HOST', 16)),
+                 keepalive_timeout: float = float(os.getenv('MEMOS_KEEPALIVE', 30)),
+                 dns_ttl: int = int(os.getenv('MEMOS_DNS_TTL', 300))):
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self._clients: Dict[Tuple[str, str], Tuple[asyncio.AbstractEventLoop, ClientSession, RetryClient]] = {}
+
+    def get(self, url: str) -> RetryClient:
+        """获取url所在主机的RetryClient, 不存在或已失效时新建
+
+        Args:
+            url (str): 请求地址
+
+        Returns:
+            RetryClient: 该主机共享的RetryClient
+        """
+        loop = asyncio.get_running_loop()
+        url_parts = urlparse(str(url))
+        key = (url_parts.scheme, url_parts.netloc)
+        entry = self._clients.get(key)
+        if entry is None or entry[0] is not loop or entry[1].closed:
+            connector = TCPConnector(
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_ttl,
+                use_dns_cache=True,
+                ssl=False
+            )
+            client_session = ClientSession(connector=connector, trust_env=False,
+                                           trace_configs=[request_metrics.trace_config(url_parts.netloc)])
+            entry = (loop, client_session, RetryClient(client_session=client_session))
+            self._clients[key] = entry
+            logger.debug(f'新建{url_parts.scheme}://{url_parts.netloc}的连接池')
+        return entry[2]
+
+    async def close(self) -> None:
+        """关闭当前事件循环里创建的所有连接池
+        """
+        loop = asyncio.get_running_loop()
+        for key, (owner, client_session, retry_client) in list(self._clients.items()):
+            if owner is loop:
+                del self._clients[key]
+                await retry_client.close()
+                await client_session.close()
+
+    def close_all(self) -> None:
+        """同步关闭所有连接池, 用于CLI退出, 已经关闭的事件循环直接丢弃
+        """
+        for owner in {entry[0] for entry in self._clients.values()}:
+            if owner.is_closed() or owner.is_running():
+                continue
+            owner.run_until_complete(self.close())
+        self._clients.clear()
+
+
+sessions = SessionManager()
+
+
+async def close_sessions() -> None:
+    """关闭连接池, bot退出时调用
+    """
+    await sessions.close()
+
+
+async def read_json(resp: ClientResponse, label: str = '响应数据为：') -> dict:
+    """解析一次响应, 只有debug日志会输出时才格式化响应内容
+
+    Args:
+        resp (ClientResponse): 响应
+        label (str, optional): 日志前缀. Defaults to '响应数据为：'.
+
+    Returns:
+        dict: 解析后的数据, 安装了orjson时用orjson解析
+    """
+    data = json_loads(await resp.read())
+    logger.opt(lazy=True).debug(label + '{}', lambda: data)
+    return data
+
+
+async def ping(base: str) -> bool:
+    """探测主机是否恢复, 只要不是5xx就认为服务在线
+
+    Args:
+        base (str): scheme://netloc
+
+    Returns:
+        bool: 主机是否可用
+    """
+    retry_client = sessions.get(base)
+    async with retry_client.get(f'{base}/api/ping', ssl=False, retry_options=ExponentialRetry(attempts=1),
+                                timeout=ClientTimeout(total=host_policies.get(base).connect_timeout * 2)) as resp:
+        return resp.status < 500
+
+
+host_policies = HostPolicies(ping)
+
+
 class Request:
-    def __init__(self, *args, **kwargs):
-        self.client_session = ClientSession(trust_env=False)
-        self.retry_client = RetryClient(client_session=self.client_session)
-        self.request = self.retry_client.request(*args, **kwargs)
+    """发送一次请求, 依次经过主机的熔断检查、令牌桶和按操作类型的重试与总时限
+
+    Args:
+        method (str): 请求方法
+        url (str): 请求地址
+        op (str, optional): 操作类型read/write/upload, 决定时限和重试策略. Defaults to 'read'.
+    """
+    def __init__(self, method: str, url: str, op: str = 'read', **kwargs):
+        self.method = method
+        self.url = url
+        self.op = op
+        self.kwargs = kwargs
+        self.response: ClientResponse | None = None
+        self.write = method not in ('GET', 'HEAD')
 
     async def __aenter__(self) -> ClientResponse:
-        return await self.request
+        # 写请求开始和结束时都让GET的合并和缓存失效, 期间开始的GET也不会进缓存
+        if self.write:
+            single_flight.begin_write(self.url)
+        try:
+            return await self._send()
+        except BaseException:
+            if self.write:
+                single_flight.end_write(self.url)
+            raise
+
+    async def _send(self) -> ClientResponse:
+        policy = host_policies.get(self.url)
+        policy.breaker.check()
+        await policy.bucket.acquire()
+        retry_client = sessions.get(self.url)
+        deadline = policy.deadlines[self.op]
+        self.kwargs.setdefault('retry_options', policy.retries[self.op])
+        self.kwargs.setdefault('timeout', ClientTimeout(total=deadline, sock_connect=policy.connect_timeout))
+        try:
+            # 单次请求和整个重试过程都不超过该操作的时限
+            self.response = await asyncio.wait_for(
+                retry_client.request(self.method, self.url, **self.kwargs), deadline)
+        except (ClientConnectionError, asyncio.TimeoutError):
+            policy.breaker.record_failure()
+            raise
+        if self.response.status >= 500:
+            policy.breaker.record_failure()
+        else:
+            policy.breaker.record_success()
+        return self.response
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client_session.close()
-        await self.retry_client.close()
+        try:
+            # 只归还连接, 不关闭共享的session
+            if self.response is not None:
+                self.response.release()
+        finally:
+            if self.write:
+                single_flight.end_write(self.url)
 
 
-def request(method, url, params=None, headers=None, data=None, json=None):
+def request(method, url, params=None, headers=None, data=None, json=None, op=None):
+    if op is None:
+        op = 'read' if method in ('GET', 'HEAD') else 'write'
     if headers is None:
         headers = {}
     if params is None:
         params = {}
     if json is not None:
-        return Request(method, url, params=params, headers=headers, ssl=False, json=json,
-                       timeout=ClientTimeout(total=100))
+        return Request(method, url, op=op, params=params, headers=headers, ssl=False, json=json)
     else:
-        return Request(method, url, params=params, headers=headers, data=data, ssl=False,
-                       timeout=ClientTimeout(total=100))
+        return Request(method, url, op=op, params=params, headers=headers, data=data, ssl=False)
+
+
+class SingleFlight:
+    """相同的GET请求只发一次, 同时到达的调用共享同一个请求和解码结果, 可选短时间缓存
+
+    key为url和参数. 同一主机的写请求开始和收到响应时, 缓存和进行中的记录都会丢弃, 之后的读取重新请求;
+    写请求进行期间开始的GET可能读到写之前的数据, 它们的结果不放进缓存.
+    结果在调用之间共享, 列表会浅拷贝一份返回, 里面的记录不要修改.
+    """
+    def __init__(self, ttl: float = float(os.getenv('MEMOS_GET_TTL', 0))):
+        self.ttl = ttl
+        self._inflight: Dict[Tuple[str, str, tuple], asyncio.Task] = {}
+        self._cache: Dict[Tuple[str, str, tuple], Tuple[float, Any]] = {}
+        # 每个主机进行中的写请求数和失效次数, GET开始后主机有过失效或者仍有写请求时结果不进缓存
+        self._writing: Dict[str, int] = defaultdict(int)
+        self._generation: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def _key(url: str, params: dict | None) -> Tuple[str, str, tuple]:
+        return urlparse(url).netloc, url, tuple(sorted((params or {}).items()))
+
+    async def _fetch(self, key: Tuple[str, str, tuple], url: str, params: dict | None, label: str,
+                     convert: Callable[[Any], Any] | None) -> Any:
+        netloc = key[0]
+        generation = self._generation[netloc]
+        async with request('GET', url, params=params) as resp:
+            data = await read_json(resp, label)
+            assert resp.status == 200
+        data = data['data'] if convert is None else convert(data['data'])
+        # 请求期间如果有写操作, 这个结果可能已经过时, 不放进缓存
+        if self.ttl > 0 and generation == self._generation[netloc] and not self._writing[netloc]:
+            self._cache[key] = (time.monotonic() + self.ttl, data)
+        return data
+
+    def _done(self, key: Tuple[str, str, tuple], task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def get(self, url: str, params: dict = None, label: str = '响应数据为：',
+                  convert: Callable[[Any], Any] = None) -> Any:
+        """发送GET请求并返回响应里的data字段
+
+        Args:
+            url (str): 请求地址
+            params (dict, optional): 请求参数. Defaults to None.
+            label (str, optional): 日志前缀. Defaults to '响应数据为：'.
+            convert (Callable[[Any], Any], optional): 对data的转换, 只在真正请求时执行一次. Defaults to None.
+
+        Returns:
+            Any: 转换后的data
+        """
+        key = self._key(url, params)
+        path = urlparse(url).path
+        entry = self._cache.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                request_metrics.record_saved('GET', path, 'cache')
+                return self._copy(entry[1])
+            del self._cache[key]
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, url, params, label, convert))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            request_metrics.record_saved('GET', path, 'coalesced')
+        # 一个调用方被取消不影响共享这个请求的其他调用方
+        return self._copy(await asyncio.shield(task))
+
+    @staticmethod
+    def _copy(data: Any) -> Any:
+        return list(data) if isinstance(data, list) else data
+
+    def begin_write(self, url: str) -> None:
+        self._writing[urlparse(url).netloc] += 1
+        self.invalidate(url)
+
+    def end_write(self, url: str) -> None:
+        self._writing[urlparse(url).netloc] -= 1
+        self.invalidate(url)
+
+    def invalidate(self, url: str = None) -> None:
+        """丢弃url所在主机的缓存和进行中的记录, url为None时全部丢弃
+        """
+        netloc = urlparse(url).netloc if url is not None else None
+        for host in ([netloc] if netloc is not None else list(self._generation)):
+            self._generation[host] += 1
+        for store in (self._cache, self._inflight):
+            for key in [k for k in store if netloc is None or k[0] == netloc]:
+                del store[key]
+
+
+single_flight = SingleFlight()
+
+
+UPLOAD_CHUNK_SIZE = int(os.getenv('MEMOS_UPLOAD_CHUNK', 64 * 1024))
 
 
 STATUS = Literal['NORMAL', 'ARCHIVED']
@@ -47,7 +302,9 @@ VISIBILITY = Literal['PRIVATE', 'PROTECTED', 'PUBLIC']
 
 
 class Base:
-    def __init__(self, token: str = os.getenv('OPEN_API')):
+    def __init__(self, token: str = None):
+        # 调用时再读环境变量, 守护进程里每条命令可以使用不同的OPEN_API
+        self.token = token = token or os.getenv('OPEN_API')
         try:
             url_parts = urlparse(token)
             self.scheme = url_parts.scheme
@@ -68,9 +325,106 @@ class Base:
         self.res_path = 'api/resource'
 
 
+class MemoCache:
+    """按主机、openId和memo id缓存MemoRecord的LRU, size为0时不缓存
+
+    send_memo和update_memo把服务器返回的记录写入缓存, delete_memo删除,
+    列表接口返回的记录也会写入. 写入时比较updatedTs, 旧的记录不会覆盖缓存里更新的记录.
+    """
+    def __init__(self,
+                 size: int = int(os.getenv('MEMOS_MEMO_CACHE_SIZE', 0)),
+                 ttl: float = float(os.getenv('MEMOS_MEMO_CACHE_TTL', 60))):
+        self.size = size
+        self.ttl = ttl
+        self._memos: OrderedDict[Tuple[str, str, str, int], Tuple[float, MemoRecord]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[str, str, str, int]) -> MemoRecord | None:
+        if self.size <= 0:
+            return None
+        entry = self._memos.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._memos.pop(key, None)
+            self.misses += 1
+            return None
+        self._memos.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Tuple[str, str, str, int], memo: MemoRecord, force: bool = False) -> MemoRecord:
+        """写入缓存, 返回两者中较新的记录
+
+        Args:
+            key (Tuple[str, str, str, int]): scheme, netloc, query和memo id
+            memo (MemoRecord): 服务器返回的记录
+            force (bool, optional): 写操作的响应直接覆盖, 不比较updatedTs. Defaults to False.
+
+        Returns:
+            MemoRecord: memo不比缓存里的新时返回缓存里的记录
+        """
+        if self.size <= 0:
+            return memo
+        entry = self._memos.get(key)
+        if not force and entry is not None and entry[0] >= time.monotonic():
+            cached_ts, new_ts = entry[1].updated_ts or 0, memo.updated_ts or 0
+            # updatedTs精确到秒, 相同时保留缓存里的, 它可能来自刚完成的写操作
+            if cached_ts >= new_ts:
+                if cached_ts > new_ts:
+                    self.stale += 1
+                return entry[1]
+        self._memos[key] = (time.monotonic() + self.ttl, memo)
+        self._memos.move_to_end(key)
+        while len(self._memos) > self.size:
+            self._memos.popitem(last=False)
+            self.evictions += 1
+        return memo
+
+    def invalidate(self, key: Tuple[str, str, str, int] = None) -> None:
+        if key is None:
+            self._memos.clear()
+        else:
+            self._memos.pop(key, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._memos),
+            'capacity': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'stale': self.stale,
+            'evictions': self.evictions
+        }
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, value in self.stats().items():
+            if name in ('hits', 'misses', 'stale', 'evictions'):
+                lines.append(f'# TYPE memos_memo_cache_{name}_total counter')
+                lines.append(f'memos_memo_cache_{name}_total {value}')
+        lines.append('# TYPE memos_memo_cache_size gauge')
+        lines.append(f'memos_memo_cache_size {len(self._memos)}')
+        return '\n'.join(lines) + '\n'
+
+
+memo_cache = MemoCache()
+
+
 class Memo(Base):
+    def _cache_key(self, memo_id: int) -> Tuple[str, str, str, int]:
+        return self.scheme, self.netloc, self.query, int(memo_id)
+
+    def _remember(self, memos: List[MemoRecord]) -> List[MemoRecord]:
+        """列表结果写入缓存, 缓存里更新的记录替换列表里过时的"""
+        if memo_cache.size > 0:
+            memos = [memo_cache.put(self._cache_key(m.id), m) for m in memos]
+        return memos
 
-    async def get_memos(self, limit: int = None, status: STATUS = 'NORMAL') -> List[dict]:
+    async def get_memos(self, limit: int = None, status: STATUS = 'NORMAL') -> List[MemoRecord]:
         """获取所有memos
 
         Args:
@@ -78,7 +432,7 @@ class Memo(Base):
             status (STATUS, optional): 获取正常memo还是归档的memo. Defaults to 'NORMAL'.
 
         Returns:
-            List[dict]: 成功返回所有数据
+            List[MemoRecord]: 成功返回所有数据, 可以像dict一样用字段名访问
             Example:
             {
                 "id": 1023,
@@ -101,28 +455,24 @@ class Memo(Base):
         if limit is not None:
             params.update({'limit': limit})
         logger.debug(f'参数数据为：{params}')
-        async with Request("GET", url, params=params) as resp:
-            logger.debug(f'响应数据为：{await resp.json()}')
-            assert resp.status == 200
-            data = await resp.json()
-            return data['data']
+        return self._remember(await single_flight.get(url, params=params, convert=memo_records))
 
-    async def get_memo(self, memo_id: int) ->List[dict]:
+    async def get_memo(self, memo_id: int) -> MemoRecord:
         """根据ID获取memo
 
         Args:
             memo_id (int): memo的id
 
         Returns:
-            List[dict]: 成功返回数据
+            MemoRecord: 成功返回数据
         """
+        key = self._cache_key(memo_id)
+        memo = memo_cache.get(key)
+        if memo is not None:
+            return memo
         memo_id = str(memo_id)
         url = f'{self.scheme}://{self.netloc}/{self.memo_path}/{memo_id}?{self.query}'
-        async with Request("GET", url) as resp:
-            logger.debug(f'响应数据为：{await resp.json()}')
-            assert resp.status == 200
-            data = await resp.json()
-            return data['data']
+        return memo_cache.put(key, await single_flight.get(url, convert=MemoRecord))
 
     async def send_memo(self, text: str = None, visibility: VISIBILITY = "PRIVATE", res_ids: List[int] = None) -> int:
         """发送图文memo
@@ -145,20 +495,47 @@ class Memo(Base):
         logger.debug(f'请求数据为：{data}')
         url = f'{self.scheme}://{self.netloc}/{self.memo_path}?{self.query}'
         async with request("POST", url=url, json=data) as resp:
-            logger.debug(f'响应数据为：{await resp.json()}')
+            resp_data = await read_json(resp)
             assert resp.status == 200
-            resp_data = await resp.json()
-            return resp_data['data']['id']
-
-    async def update_memo(self, memo_id: int, text: str = None, visibility: VISIBILITY = "PRIVATE", res_ids: List[int] = None, status: STATUS = 'NORMAL') -> None:
+            memo = MemoRecord(resp_data['data'])
+            memo_cache.put(self._cache_key(memo.id), memo, force=True)
+            return memo.id
+
+    @staticmethod
+    def _changes(data: dict, current: MemoRecord | dict) -> dict:
+        """去掉和已知状态相同的字段"""
+        changes = {}
+        for key, value in data.items():
+            if key == 'resourceIdList':
+                known = [r['id'] for r in current.get('resourceList') or []] if 'resourceList' in current else None
+            else:
+                known = current.get(key)
+            if known is None or known != value:
+                changes[key] = value
+        return changes
+
+    async def update_memo(self,
+                          memo_id: int,
+                          text: str = None,
+                          visibility: VISIBILITY = None,
+                          res_ids: List[int] = None,
+                          status: STATUS = None,
+                          current: MemoRecord | dict = None) -> MemoRecord | None:
         """更新memo,主要用于修改已经发送的memo,可用于更新可见和状态
 
+        只发送传入且和已知状态不同的字段, 已知状态为current, 没有传入时使用memo缓存. 没有需要修改的字段时不发请求,
+        直接返回已知状态.
+
         Args:
             memo_id (int): memo id
             text (str, optional): 更新的内容, 默认为不更新内容. Defaults to None.
-            visibility (VISIBILITY, optional): 可见状态, 默认为私人. Defaults to "PRIVATE".
+            visibility (VISIBILITY, optional): 可见状态, 默认为不更新. Defaults to None.
             res_ids (List[int], optional): 资源ID. Defaults to None.
-            status (STATUS, optional): memo状态. Defaults to 'NORMAL'.
+            status (STATUS, optional): memo状态, 默认为不更新. Defaults to None.
+            current (MemoRecord | dict, optional): 调用方已经拿到的memo. Defaults to None.
+
+        Returns:
+            MemoRecord | None: 服务器返回的更新后的memo, 没有发请求时为已知状态, 都没有时为None
         """
         data = {
             # "id": memo_id,
@@ -168,15 +545,31 @@ class Memo(Base):
         if visibility is not None:
             data.update({'visibility': visibility})
         if res_ids is not None:
-            data.update({'resourceIdList': res_ids})
+            data.update({'resourceIdList': list(res_ids)})
         if status is not None:
             data.update({'rowStatus': status})
-        logger.debug(f'请求数据为：{data}')
-        memo_id = str(memo_id)
+        key = self._cache_key(memo_id)
+        if current is None:
+            current = memo_cache.get(key)
+        if current is not None:
+            data = self._changes(data, current)
         url = f'{self.scheme}://{self.netloc}/{self.memo_path}/{memo_id}?{self.query}'
+        if not data:
+            logger.debug(f'memo{memo_id}没有需要更新的字段')
+            request_metrics.record_saved('PATCH', urlparse(url).path, 'noop')
+            if current is None or isinstance(current, MemoRecord):
+                return current
+            return MemoRecord(current)
+        logger.debug(f'请求数据为：{data}')
+        memo_cache.invalidate(key)
         async with request("PATCH", url, json=data) as resp:
-            logger.debug(f'响应数据为：{await resp.json()}')
+            resp_data = await read_json(resp)
             assert resp.status == 200
+        if not isinstance(resp_data.get('data'), dict):
+            return None
+        memo = MemoRecord(resp_data['data'])
+        memo_cache.put(key, memo, force=True)
+        return memo
 
     async def filter_memo(self,
                           tag: str = None,
@@ -184,7 +577,7 @@ class Memo(Base):
                           limit: int = None,
                           status: STATUS = 'NORMAL',
                           visibility: VISIBILITY | None = None,
-                          ) -> List[dict]:
+                          ) -> List[MemoRecord]:
         """筛选memo, 可多种条件共存
 
         Args:
@@ -195,7 +588,7 @@ class Memo(Base):
             visibility (VISIBILITY | None, optional): 可见性. Defaults to None.
 
         Returns:
-            List[dict]: 筛选后的数据
+            List[MemoRecord]: 筛选后的数据
         """
         url = f'{self.scheme}://{self.netloc}/{self.memo_path}?{self.query}'
         params = {
@@ -211,11 +604,64 @@ class Memo(Base):
             params.update({'visibility': visibility})
 
         logger.debug(f'搜索参数为：{params}')
-        async with request("GET", url, params=params) as resp:
-            logger.debug(f'搜索响应为{await resp.json()}')
-            assert resp.status == 200
-            resp_data = await resp.json()
-            return resp_data['data']
+        return self._remember(await single_flight.get(url, params=params, label='搜索响应为', convert=memo_records))
+
+    async def iter_memos(self,
+                         tag: str = None,
+                         status: STATUS = 'NORMAL',
+                         visibility: VISIBILITY | None = None,
+                         page_size: int = int(os.getenv('MEMOS_PAGE_SIZE', 200)),
+                         ) -> AsyncIterator[MemoRecord]:
+        """按offset/limit分页遍历memo, 处理当前页时预取下一页, 内存只占用一到两页
+
+        Args:
+            tag (str, optional): 根据已有tag筛选. Defaults to None.
+            status (STATUS, optional): 状态. Defaults to 'NORMAL'.
+            visibility (VISIBILITY | None, optional): 可见性. Defaults to None.
+            page_size (int, optional): 每页条数. Defaults to 200.
+
+        Yields:
+            MemoRecord: 单条memo
+        """
+        def fetch(offset: int) -> asyncio.Task:
+            return asyncio.create_task(self.filter_memo(tag=tag, offset=offset, limit=page_size,
+                                                        status=status, visibility=visibility))
+
+        offset = 0
+        next_page = fetch(offset)
+        try:
+            while next_page is not None:
+                page: List[MemoRecord] = await next_page
+                next_page = None
+                logger.debug(f'分页获取memo, offset为{offset}, 本页{len(page)}条')
+                if len(page) == page_size:
+                    offset += page_size
+                    next_page = fetch(offset)
+                for m in page:
+                    yield m
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    def search(self, query: str = None, tag: str = None, status: STATUS = 'NORMAL', limit: int = 20) -> List[dict]:
+        """在本地镜像里搜索memo, 需要先运行sync同步
+
+        Args:
+            query (str, optional): 内容包含的文字. Defaults to None.
+            tag (str, optional): 包含的tag. Defaults to None.
+            status (STATUS, optional): 状态. Defaults to 'NORMAL'.
+            limit (int, optional): 最多返回条数. Defaults to 20.
+
+        Returns:
+            List[dict]: 匹配的memo
+        """
+        from memos.mirror import Mirror
+
+        mirror = Mirror(self.token)
+        try:
+            return mirror.search(query=query, tag=tag, status=status, limit=limit)
+        finally:
+            mirror.close()
 
     async def delete_memo(self, memo_id: int) -> None:
         """删除memo
@@ -223,27 +669,23 @@ class Memo(Base):
         Args:
             memo_id (int): memo id
         """         
+        memo_cache.invalidate(self._cache_key(memo_id))
         memo_id = str(memo_id)
         url = f'{self.scheme}://{self.netloc}/{self.memo_path}/{memo_id}?{self.query}'
         async with request("DELETE", url) as resp:
-            logger.debug(f'响应数据为：{await resp.json()}')
+            await read_json(resp)
             assert resp.status == 200
 
 
 class Resource(Base):
-    async def get_resources(self) -> List[dict]:
+    async def get_resources(self) -> List[ResourceRecord]:
         """获取资源
 
         Returns:
-            List[dict]: 成功返回资源数据
+            List[ResourceRecord]: 成功返回资源数据
         """
         url = f'{self.scheme}://{self.netloc}/{self.res_path}?{self.query}'
-        async with Request("GET", url) as r:
-            logger.debug(f'获取资源响应数据为：{await r.json()}')
-            assert r.status == 200
-            data = await r.json()
-            logger.debug(f'资源为：{data["data"]}')
-            return data['data']
+        return await single_flight.get(url, label='获取资源响应数据为：', convert=resource_records)
 
     async def upload_resource(self, res_path: Path, filename: str, content_type: str = 'image/*') -> int:
         """从本地上传图片
@@ -256,18 +698,33 @@ class Resource(Base):
         Returns:
             int: 成功返回资源id
         """
-        data = FormData()
-        data.add_field(
-            'file',
-            Path(res_path).open(mode="rb"),
-            filename=filename,
-            content_type=content_type
-        )
         url = f'{self.scheme}://{self.netloc}/{self.res_path}/blob?{self.query}'
-        async with request("POST", url, data=data) as resp:
-            logger.debug(f'响应数据为：{await resp.json()}')
+        # 文件对象由aiohttp分块读取发送, 不会整个读进内存
+        with Path(res_path).open(mode="rb") as f:
+            data = FormData()
+            data.add_field('file', f, filename=filename, content_type=content_type)
+            async with request("POST", url, data=data, op='upload') as resp:
+                res_data = await read_json(resp)
+                assert resp.status == 200
+                return res_data['data']['id']
+
+    async def upload_resource_by_content(self, content: bytes, filename: str, content_type: str = 'image/*') -> int:
+        """上传已经在内存里的文件
+
+        Args:
+            content (bytes): 文件内容
+            filename (str): 文件名
+            content_type (str, optional): 资源类型. Defaults to 'image/*'.
+
+        Returns:
+            int: 成功返回资源id
+        """
+        url = f'{self.scheme}://{self.netloc}/{self.res_path}/blob?{self.query}'
+        data = FormData()
+        data.add_field('file', content, filename=filename, content_type=content_type)
+        async with request("POST", url, data=data, op='upload') as resp:
+            res_data = await read_json(resp)
             assert resp.status == 200
-            res_data = await resp.json()
             return res_data['data']['id']
 
     async def upload_resource_by_exlink(self, res_link: str, filename: str, content_type: str = 'image/*') -> int:
@@ -289,9 +746,8 @@ class Resource(Base):
         }
         logger.debug(f'请求数据为：{data}')
         async with request("POST", url, json=data) as resp:
-            logger.debug(f'响应数据为：{await resp.json()}')
+            res_data = await read_json(resp)
             assert resp.status == 200
-            res_data = await resp.json()
             return res_data['data']['id']
 
     async def upload_resource_by_stream(self, res_link: str , filename: str, content_type: str = 'image/*') -> int:
@@ -303,16 +759,18 @@ class Resource(Base):
             content_type (str, optional): 资源类型. Defaults to 'image/*'.
 
         Returns:
-            int: _description_
+            int: 成功返回资源id
         """
         url = f'{self.scheme}://{self.netloc}/{self.res_path}/blob?{self.query}'
-        async with request("GET", res_link) as r:
+        # 下载和上传同时进行, 按上传的时限
+        async with request("GET", res_link, op='upload') as r:
+            assert r.status == 200
+            # 下载流按固定大小分块直接写进multipart请求体, 内存占用与文件大小无关
             data = FormData()
-            data.add_field('file', r.content, filename=filename, content_type=content_type)
-            async with request("POST", url, data=data) as resp:
-                logger.debug(f'响应数据为：{await resp.json()}')
+            data.add_field('file', r.content.iter_chunked(UPLOAD_CHUNK_SIZE), filename=filename, content_type=content_type)
+            async with request("POST", url, data=data, op='upload') as resp:
+                res_data = await read_json(resp)
                 assert resp.status == 200
-                res_data = await resp.json()
                 return res_data['data']['id']
 
 
@@ -325,58 +783,138 @@ class Resource(Base):
         Raises:
             ValueError: 
         """
-        res_data: List[dict] = await self.get_resources()
+        res_data: List[ResourceRecord] = await self.get_resources()
         res_ids = []
         for data in res_data:
             res_ids.append(data['id'])
         if res_id in res_ids:
-            res_id = str(res_id)
-            url = f'{self.scheme}://{self.netloc}/{self.res_path}/{res_id}?{self.query}'
-            async with request("DELETE", url) as resp:
-                logger.debug(f'资源删除响应数据为：{await resp.json()}')
-                assert resp.status == 200
+            await self._delete(res_id)
         else:
             logger.debug(f'不存在这个资源，请查看是否拼写错误！要删除的tag为{res_id}')
             raise ValueError(res_id)
 
+    async def _delete(self, res_id: int) -> None:
+        """直接删除, 调用方已经确认资源存在"""
+        url = f'{self.scheme}://{self.netloc}/{self.res_path}/{res_id}?{self.query}'
+        async with request("DELETE", url) as resp:
+            await read_json(resp, '资源删除响应数据为：')
+            assert resp.status == 200
+
+    async def gc(self,
+                 dry_run: bool = False,
+                 min_age: float = 0,
+                 batch_size: int = 0,
+                 concurrency: int = 8,
+                 executor: BulkExecutor = None) -> dict:
+        """删除没有被memo引用的资源, 只获取一次资源列表, 适合用cron定期运行
 
-    async def clear_resource(self):
+        Args:
+            dry_run (bool, optional): 只列出会删除的资源, 不删除. Defaults to False.
+            min_age (float, optional): 只删除创建超过这么多秒的资源, 避免删掉刚上传还没发memo的图片. Defaults to 0.
+            batch_size (int, optional): 本次最多删除的数量, 从最早创建的开始, 0为不限制. Defaults to 0.
+            concurrency (int, optional): 没有传入executor时的删除并发数. Defaults to 8.
+            executor (BulkExecutor, optional): 批量执行器, 控制并发、限速和重试. Defaults to None.
+
+        Returns:
+            dict: 执行汇总, orphans为未被引用的资源数, eligible为满足min_age的数量, remaining为留给下次运行的数量
+        """
+        cutoff = time.time() - min_age
+        orphans = [r for r in await self.get_resources() if r['linkedMemoAmount'] == 0]
+        eligible = sorted((r for r in orphans if r['createdTs'] <= cutoff), key=lambda r: (r['createdTs'], r['id']))
+        selected = eligible[:batch_size] if batch_size > 0 else eligible
+        plan = {
+            'orphans': len(orphans),
+            'eligible': len(eligible),
+            'selected': len(selected),
+            'remaining': len(eligible) - len(selected),
+            'bytes': sum(r['size'] or 0 for r in selected)
+        }
+        logger.debug(f'未被使用的资源：{[r["id"] for r in selected]}')
+        if dry_run:
+            return {'name': 'resource_gc', 'dry_run': True, 'ids': [r['id'] for r in selected], **plan}
+        executor = executor or BulkExecutor(concurrency=concurrency)
+        report = await executor.run('resource_gc', [r['id'] for r in selected], self._delete)
+        return {**report.summary(), **plan}
+
+    async def clear_resource(self, executor: BulkExecutor = None) -> dict | None:
         """清除未被使用的资源，谨慎操作！！！
+
+        Args:
+            executor (BulkExecutor, optional): 批量执行器, 控制并发和限速. Defaults to None.
+
+        Returns:
+            dict | None: 有删除时返回执行汇总
         """
-        url = f'{self.scheme}://{self.netloc}/{self.res_path}?{self.query}'
-        no_link_memo_ids: List[int] = []
-        async with Request("GET", url) as r:
-            logger.debug(f'获取资源响应数据为：{await r.json()}')
-            assert r.status == 200
-            data = await r.json()
-            for res in data['data']:
-                if res['linkedMemoAmount'] == 0:
-                    no_link_memo_ids.append(res['id'])
-        logger.debug(f'未被使用的资源：{no_link_memo_ids}')
-        if len(no_link_memo_ids) != 0:
-            tasks = [ asyncio.create_task(self.delete_resource(res_id)) for res_id in no_link_memo_ids ]
-            finished, unfinished = await asyncio.wait(tasks)
-            all_results = [r.result() for r in finished]
-            logger.debug(all_results)
-            for result in all_results:
-                logger.debug(f'{result}\n')
+        summary = await self.gc(executor=executor)
+        if summary['selected']:
+            return summary
+        logger.debug(f'没有未被使用的资源')
+
+
+class TagRegistry:
+    """按主机和openId缓存已经存在的tag, 创建前先查缓存, 只创建缺少的tag
+
+    缓存过期或调用invalidate后, 下一次使用时重新从get_tags获取.
+    """
+    def __init__(self, ttl: float = float(os.getenv('MEMOS_TAG_TTL', 300))):
+        self.ttl = ttl
+        self._tags: Dict[Tuple[str, str, str], Tuple[float, set]] = {}
+
+    def get(self, key: Tuple[str, str, str]) -> set | None:
+        entry = self._tags.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def seed(self, key: Tuple[str, str, str], tags: List[str]) -> None:
+        self._tags[key] = (time.monotonic(), set(tags))
+
+    def add(self, key: Tuple[str, str, str], name: str) -> None:
+        tags = self.get(key)
+        if tags is not None:
+            tags.add(name)
+
+    def discard(self, key: Tuple[str, str, str], name: str) -> None:
+        tags = self.get(key)
+        if tags is not None:
+            tags.discard(name)
+
+    def invalidate(self, key: Tuple[str, str, str] = None) -> None:
+        if key is None:
+            self._tags.clear()
         else:
-            logger.debug(f'没有未被使用的资源')
+            self._tags.pop(key, None)
+
+
+tag_registry = TagRegistry()
 
 
 class Tag(Base):
+    @property
+    def registry_key(self) -> Tuple[str, str, str]:
+        return self.scheme, self.netloc, self.query
+
     async def get_tags(self) -> List[str]:
-        """获取所有TAG
+        """获取所有TAG, 同时刷新tag缓存
 
         Returns:
             List[str]: tag列表
         """
         url = f'{self.scheme}://{self.netloc}/{self.tag_path}?{self.query}'
-        async with Request("GET", url) as r:
-            logger.debug(f'获取TAG响应数据为：{await r.json()}')
-            assert r.status == 200
-            data = await r.json()
-            return data['data']
+        tags = await single_flight.get(url, label='获取TAG响应数据为：')
+        tag_registry.seed(self.registry_key, tags)
+        return tags
+
+    async def known_tags(self) -> set:
+        """已经存在的tag, 优先使用缓存
+
+        Returns:
+            set: tag集合
+        """
+        tags = tag_registry.get(self.registry_key)
+        if tags is None:
+            tags = set(await self.get_tags())
+        return tags
 
     async def create_tag(self, name: str) -> None:
         """创建tag
@@ -387,8 +925,24 @@ class Tag(Base):
         url = f'{self.scheme}://{self.netloc}/{self.tag_path}?{self.query}'
         data = {'name': name}
         async with request("POST", url, json=data) as resp:
-            logger.debug(f'响应数据为：{await resp.json()}')
+            await read_json(resp)
             assert resp.status == 200
+        tag_registry.add(self.registry_key, name)
+
+    async def ensure_tags(self, names: List[str]) -> List[str]:
+        """只创建缓存里没有的tag, 并发创建
+
+        Args:
+            names (List[str]): 需要存在的tag
+
+        Returns:
+            List[str]: 实际新建的tag
+        """
+        tags = await self.known_tags()
+        missing = [name for name in dict.fromkeys(names) if name not in tags]
+        if missing:
+            await asyncio.gather(*[self.create_tag(name) for name in missing])
+        return missing
 
     async def delete_tag(self, name: str) -> None:
         """删除tag
@@ -399,14 +953,18 @@ class Tag(Base):
         Raises:
             ValueError: 
         """
-        tags: List[str] = await self.get_tags()
+        tags = await self.known_tags()
+        if name not in tags:
+            # 缓存可能过时, 重新获取一次再判断
+            tags = set(await self.get_tags())
         logger.debug(f'全部tags为：{tags}')
         if name in tags:
             url = f'{self.scheme}://{self.netloc}/{self.tag_path}/delete?{self.query}'
             data = {'name': name}
             async with request("POST", url, json=data) as resp:
-                logger.debug(f'响应数据为：{await resp.json()}')
+                await read_json(resp)
                 assert resp.status == 200
+            tag_registry.discard(self.registry_key, name)
         else:
             logger.debug(f'不存在这个tag，请查看是否拼写错误！要删除的tag为{name}')
             raise ValueError(name)
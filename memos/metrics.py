@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import re
+import time
+
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+from aiohttp import ClientSession, TraceConfig
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 100)
+ID_PATH = re.compile(r'/\d+(?=/|$)')
+# 本项目调用的Memos接口, 其他路径都记为OTHER_ENDPOINT
+ENDPOINTS = frozenset({
+    '/api/ping',
+    '/api/memo', '/api/memo/{id}',
+    '/api/tag', '/api/tag/delete',
+    '/api/resource', '/api/resource/{id}', '/api/resource/blob',
+})
+OTHER_ENDPOINT = 'other'
+
+
+def endpoint_of(path: str) -> str:
+    """把路径里的id换成{id}, 例如/api/memo/12 -> /api/memo/{id}
+
+    不是已知Memos接口的路径统一记为other, 例如路径里带bot token的Telegram文件地址, 不会原样出现在指标里.
+    """
+    endpoint = ID_PATH.sub('/{id}', path)
+    return endpoint if endpoint in ENDPOINTS else OTHER_ENDPOINT
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """按桶估算分位数, 返回所在桶的上界"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.max
+
+
+class RequestMetrics:
+    """按接口和方法统计请求耗时、重试、状态码和收发字节数, 数据来自aiohttp的TraceConfig
+    """
+    def __init__(self):
+        self.report_at_exit = False
+        self.reset()
+
+    def reset(self) -> None:
+        self.latency: Dict[Tuple[str, str], Histogram] = defaultdict(Histogram)
+        self.status: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        self.retries: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.errors: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.bytes_sent: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.bytes_received: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.dns_seconds: Dict[str, float] = defaultdict(float)
+        self.connect_seconds: Dict[str, float] = defaultdict(float)
+        self.saved: Dict[Tuple[str, str, str], int] = defaultdict(int)
+
+    def record_saved(self, method: str, path: str, reason: str) -> None:
+        """记录一次没有发出去的请求, reason为coalesced(合并到进行中的请求)、cache(命中缓存)或noop(没有需要修改的内容)
+        """
+        self.saved[(method, endpoint_of(path), reason)] += 1
+
+    @staticmethod
+    def _key(params) -> Tuple[str, str]:
+        return params.method, endpoint_of(params.url.path)
+
+    async def on_request_start(self, session: ClientSession, ctx: SimpleNamespace, params) -> None:
+        ctx.start = time.perf_counter()
+        attempt = (ctx.trace_request_ctx or {}).get('current_attempt', 1)
+        if attempt > 1:
+            self.retries[self._key(params)] += 1
+
+    async def on_request_end(self, session: ClientSession, ctx: SimpleNamespace, params) -> None:
+        key = self._key(params)
+        self.latency[key].observe(time.perf_counter() - ctx.start)
+        self.status[key + (params.response.status,)] += 1
+
+    async def on_request_exception(self, session: ClientSession, ctx: SimpleNamespace, params) -> None:
+        key = self._key(params)
+        self.latency[key].observe(time.perf_counter() - ctx.start)
+        self.errors[key] += 1
+
+    async def on_request_chunk_sent(self, session: ClientSession, ctx: SimpleNamespace, params) -> None:
+        self.bytes_sent[self._key(params)] += len(params.chunk)
+
+    async def on_response_chunk_received(self, session: ClientSession, ctx: SimpleNamespace, params) -> None:
+        self.bytes_received[self._key(params)] += len(params.chunk)
+
+    async def on_dns_resolvehost_start(self, session: ClientSession, ctx: SimpleNamespace, params) -> None:
+        ctx.dns_start = time.perf_counter()
+
+    async def on_dns_resolvehost_end(self, session: ClientSession, ctx: SimpleNamespace, params) -> None:
+        self.dns_seconds[params.host] += time.perf_counter() - ctx.dns_start
+
+    async def on_connection_create_start(self, session: ClientSession, ctx: SimpleNamespace, params) -> None:
+        ctx.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(self, session: ClientSession, ctx: SimpleNamespace, params) -> None:
+        host = getattr(ctx, 'host', '')
+        self.connect_seconds[host] += time.perf_counter() - ctx.connect_start
+
+    def trace_config(self, host: str = '') -> TraceConfig:
+        """给某个主机的连接池用的TraceConfig
+        """
+        config = TraceConfig(trace_config_ctx_factory=lambda trace_request_ctx: SimpleNamespace(
+            trace_request_ctx=trace_request_ctx, host=host))
+        config.on_request_start.append(self.on_request_start)
+        config.on_request_end.append(self.on_request_end)
+        config.on_request_exception.append(self.on_request_exception)
+        config.on_request_chunk_sent.append(self.on_request_chunk_sent)
+        config.on_response_chunk_received.append(self.on_response_chunk_received)
+        config.on_dns_resolvehost_start.append(self.on_dns_resolvehost_start)
+        config.on_dns_resolvehost_end.append(self.on_dns_resolvehost_end)
+        config.on_connection_create_start.append(self.on_connection_create_start)
+        config.on_connection_create_end.append(self.on_connection_create_end)
+        return config
+
+    def prometheus(self) -> str:
+        """Prometheus文本格式
+        """
+        lines: List[str] = [
+            '# HELP memos_request_duration_seconds Memos API request latency per attempt.',
+            '# TYPE memos_request_duration_seconds histogram',
+        ]
+        for (method, endpoint), h in sorted(self.latency.items()):
+            labels = f'method="{method}",endpoint="{endpoint}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, h.counts):
+                cumulative += n
+                lines.append(f'memos_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'memos_request_duration_seconds_bucket{{{labels},le="+Inf"}} {h.count}')
+            lines.append(f'memos_request_duration_seconds_sum{{{labels}}} {h.sum}')
+            lines.append(f'memos_request_duration_seconds_count{{{labels}}} {h.count}')
+
+        def counter(name: str, help_text: str, values: dict, label_names: Tuple[str, ...]) -> None:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for key, value in sorted(values.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                labels = ','.join(f'{n}="{v}"' for n, v in zip(label_names, key))
+                lines.append(f'{name}{{{labels}}} {value}')
+
+        counter('memos_requests_total', 'Memos API responses by status code.', self.status, ('method', 'endpoint', 'status'))
+        counter('memos_request_retries_total', 'Retried Memos API attempts.', self.retries, ('method', 'endpoint'))
+        counter('memos_request_errors_total', 'Memos API attempts that raised.', self.errors, ('method', 'endpoint'))
+        counter('memos_request_bytes_sent_total', 'Request body bytes sent.', self.bytes_sent, ('method', 'endpoint'))
+        counter('memos_response_bytes_received_total', 'Response body bytes received.', self.bytes_received, ('method', 'endpoint'))
+        counter('memos_requests_saved_total', 'Requests answered by an in-flight request or the GET cache, or skipped because nothing changed.', self.saved, ('method', 'endpoint', 'reason'))
+        counter('memos_dns_seconds_total', 'Time spent resolving hosts.', self.dns_seconds, ('host',))
+        counter('memos_connect_seconds_total', 'Time spent opening connections.', self.connect_seconds, ('host',))
+        return '\n'.join(lines) + '\n'
+
+    def summary_table(self) -> str:
+        """按接口汇总的文字表格, 用于CLI
+        """
+        header = f'{"method":7} {"endpoint":28} {"count":>6} {"errors":>6} {"retries":>7} {"mean_ms":>8} {"p95_ms":>7} {"sent":>10} {"recv":>10} {"saved":>6}  status'
+        rows = [header, '-' * len(header)]
+        # 全部被省掉的接口也列出来
+        for key in sorted({*self.latency, *((m, e) for m, e, _ in self.saved)}):
+            h = self.latency.get(key) or Histogram()
+            saved = sum(n for (m, e, _), n in self.saved.items() if (m, e) == key)
+            statuses = ' '.join(f'{s}:{n}' for (m, e, s), n in sorted(self.status.items()) if (m, e) == key)
+            rows.append(
+                f'{key[0]:7} {key[1]:28} {h.count:>6} {self.errors[key]:>6} {self.retries[key]:>7} '
+                f'{h.sum / h.count * 1000 if h.count else 0:>8.1f} {h.quantile(0.95) * 1000:>7.0f} '
+                f'{self.bytes_sent[key]:>10} {self.bytes_received[key]:>10} {saved:>6}  {statuses}'
+            )
+        return '\n'.join(rows)
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from pathlib import Path
+from typing import List
+from loguru import logger
+from memos.memosapi import Memo, Tag, Resource, STATUS
+from memos.rename import TagRewriter
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS memo (
+    source TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    row_status TEXT NOT NULL,
+    creator_id INTEGER,
+    created_ts INTEGER,
+    updated_ts INTEGER,
+    visibility TEXT,
+    pinned INTEGER,
+    content TEXT NOT NULL,
+    resource_ids TEXT,
+    PRIMARY KEY (source, id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS memo_fts USING fts5(content, tokenize='trigram');
+CREATE TABLE IF NOT EXISTS tag (
+    source TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (source, name)
+);
+CREATE TABLE IF NOT EXISTS resource (
+    source TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    filename TEXT,
+    type TEXT,
+    size INTEGER,
+    external_link TEXT,
+    created_ts INTEGER,
+    updated_ts INTEGER,
+    linked_memo_amount INTEGER,
+    PRIMARY KEY (source, id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    source TEXT PRIMARY KEY,
+    synced_at INTEGER
+);
+'''
+
+
+class Mirror:
+    """memo、tag和资源信息的本地SQLite镜像, memo内容建立FTS5(trigram)全文索引
+
+    列表接口不支持按更新时间筛选, 每次同步都是完整核对: 分页遍历全部memo,
+    只有updatedTs或rowStatus变化的memo才会写入并重建索引, 服务器上已删除的memo会从镜像中删除.
+    镜像按主机加openId的摘要区分来源, 文件里不保存openId.
+
+    Args:
+        token (str, optional): Memos Open API. Defaults to os.getenv('OPEN_API').
+        path (str, optional): 镜像文件. Defaults to os.getenv('MIRROR_DB', 'db/mirror.sqlite3').
+    """
+    def __init__(self, token: str = None, path: str = None):
+        token = token or os.getenv('OPEN_API')
+        path = path or os.getenv('MIRROR_DB', 'db/mirror.sqlite3')
+        self.memo = Memo(token)
+        self.tag = Tag(token)
+        self.res = Resource(token)
+        self.source = f'{self.memo.netloc}/{hashlib.sha256(self.memo.query.encode()).hexdigest()[:16]}'
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def _upsert_memo(self, m: dict) -> None:
+        row = self.conn.execute('SELECT rowid FROM memo WHERE source = ? AND id = ?', (self.source, m['id'])).fetchone()
+        values = (m['rowStatus'], m.get('creatorId'), m.get('createdTs'), m.get('updatedTs'), m.get('visibility'),
+                  int(bool(m.get('pinned'))), m['content'], json.dumps([r['id'] for r in m.get('resourceList') or []]))
+        if row is None:
+            cursor = self.conn.execute(
+                'INSERT INTO memo (row_status, creator_id, created_ts, updated_ts, visibility, pinned, content, resource_ids, source, id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', values + (self.source, m['id']))
+            rowid = cursor.lastrowid
+        else:
+            rowid = row[0]
+            self.conn.execute(
+                'UPDATE memo SET row_status = ?, creator_id = ?, created_ts = ?, updated_ts = ?, visibility = ?, '
+                'pinned = ?, content = ?, resource_ids = ? WHERE rowid = ?', values + (rowid,))
+            self.conn.execute('DELETE FROM memo_fts WHERE rowid = ?', (rowid,))
+        self.conn.execute('INSERT INTO memo_fts (rowid, content) VALUES (?, ?)', (rowid, m['content']))
+
+    async def sync(self) -> dict:
+        """同步memo、tag和资源信息, 遍历全部memo, 只写入有变化的
+
+        Returns:
+            dict: 同步统计
+        """
+        start = time.monotonic()
+        known = {row[0]: (row[1], row[2]) for row in self.conn.execute(
+            'SELECT id, updated_ts, row_status FROM memo WHERE source = ?', (self.source,))}
+        seen = set()
+        changed = 0
+        status: STATUS
+        for status in ('NORMAL', 'ARCHIVED'):
+            async for m in self.memo.iter_memos(status=status):
+                seen.add(m['id'])
+                if known.get(m['id']) == (m.get('updatedTs'), m['rowStatus']):
+                    continue
+                self._upsert_memo(m)
+                changed += 1
+            self.conn.commit()
+
+        deleted = [memo_id for memo_id in known if memo_id not in seen]
+        for memo_id in deleted:
+            row = self.conn.execute('SELECT rowid FROM memo WHERE source = ? AND id = ?', (self.source, memo_id)).fetchone()
+            self.conn.execute('DELETE FROM memo_fts WHERE rowid = ?', (row[0],))
+            self.conn.execute('DELETE FROM memo WHERE rowid = ?', (row[0],))
+
+        tags = await self.tag.get_tags()
+        self.conn.execute('DELETE FROM tag WHERE source = ?', (self.source,))
+        self.conn.executemany('INSERT INTO tag (source, name) VALUES (?, ?)', [(self.source, t) for t in tags])
+
+        resources = await self.res.get_resources()
+        self.conn.execute('DELETE FROM resource WHERE source = ?', (self.source,))
+        self.conn.executemany(
+            'INSERT INTO resource (source, id, filename, type, size, external_link, created_ts, updated_ts, linked_memo_amount) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(self.source, r['id'], r.get('filename'), r.get('type'), r.get('size'), r.get('externalLink'),
+              r.get('createdTs'), r.get('updatedTs'), r.get('linkedMemoAmount')) for r in resources])
+
+        self.conn.execute('INSERT OR REPLACE INTO sync_state (source, synced_at) VALUES (?, ?)',
+                          (self.source, int(time.time())))
+        self.conn.commit()
+        result = {
+            'memos': len(seen),
+            'changed': changed,
+            'deleted': len(deleted),
+            'tags': len(tags),
+            'resources': len(resources),
+            'seconds': round(time.monotonic() - start, 2)
+        }
+        logger.info(f'同步完成：{result}')
+        return result
+
+    def search(self, query: str = None, tag: str = None, status: STATUS = 'NORMAL', limit: int = 20) -> List[dict]:
+        """在本地镜像里搜索memo, 不访问服务器
+
+        Args:
+            query (str, optional): 子串, 3个字符以上走全文索引. Defaults to None.
+            tag (str, optional): 包含这个tag, 嵌套tag也算. Defaults to None.
+            status (STATUS, optional): 状态. Defaults to 'NORMAL'.
+            limit (int, optional): 最多返回条数. Defaults to 20.
+
+        Returns:
+            List[dict]: 匹配的memo
+        """
+        sql = 'SELECT m.id, m.row_status, m.created_ts, m.updated_ts, m.visibility, m.pinned, m.content, m.resource_ids FROM memo m'
+        where = ['m.source = ?', 'm.row_status = ?']
+        params: list = [self.source, status]
+        if query and len(query) >= 3:
+            sql += ' JOIN memo_fts f ON f.rowid = m.rowid'
+            where.append('memo_fts MATCH ?')
+            params.append('"' + query.replace('"', '""') + '"')
+        elif query:
+            where.append("m.content LIKE ? ESCAPE '\\'")
+            params.append('%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if tag:
+            tag = tag.strip('#')
+            where.append('instr(m.content, ?) > 0')
+            params.append(f'#{tag}')
+        sql += ' WHERE ' + ' AND '.join(where) + ' ORDER BY m.pinned DESC, m.created_ts DESC'
+
+        matcher = TagRewriter({tag: tag}).pattern if tag else None
+        results = []
+        for row in self.conn.execute(sql, params):
+            if matcher is not None and not matcher.search(row[6]):
+                continue
+            results.append({
+                'id': row[0],
+                'rowStatus': row[1],
+                'createdTs': row[2],
+                'updatedTs': row[3],
+                'visibility': row[4],
+                'pinned': bool(row[5]),
+                'content': row[6],
+                'resourceIdList': json.loads(row[7] or '[]')
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+async def sync(token: str = None, path: str = None) -> dict:
+    """把memo、tag和资源信息同步到本地镜像
+
+    Args:
+        token (str, optional): Memos Open API. Defaults to os.getenv('OPEN_API').
+        path (str, optional): 镜像文件. Defaults to os.getenv('MIRROR_DB', 'db/mirror.sqlite3').
+
+    Returns:
+        dict: 同步统计
+    """
+    mirror = Mirror(token, path)
+    try:
+        return await mirror.sync()
+    finally:
+        mirror.close()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from typing import Any, Dict, List, Tuple
+
+# 接口响应和webhook请求体共用, 安装了orjson时用orjson解析
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
+class Record:
+    """__slots__实现的紧凑记录, 同时支持record.attr和record['jsonKey']两种访问方式
+
+    子类用FIELDS声明(属性名, 接口字段名), 不认识的字段放在_extra里, 没有时不占用字典.
+    字段顺序记在_layout里, 相同顺序的记录共用一个元组, to_dict和接口返回的字段、顺序一致.
+    """
+    __slots__ = ('_layout', '_extra')
+    FIELDS: Tuple[Tuple[str, str], ...] = ()
+    _KEYS: Dict[str, str] = {}
+    _LAYOUTS: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._KEYS = {key: attr for attr, key in cls.FIELDS}
+        cls._LAYOUTS = {}
+
+    def __init__(self, data: dict):
+        layout = tuple(data)
+        self._layout = self._LAYOUTS.setdefault(layout, layout)
+        self._extra = {k: v for k, v in data.items() if k not in self._KEYS} or None
+        for attr, key in self.FIELDS:
+            setattr(self, attr, data.get(key))
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._KEYS:
+            return getattr(self, self._KEYS[key])
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self._layout:
+            layout = self._layout + (key,)
+            self._layout = self._LAYOUTS.setdefault(layout, layout)
+        if key in self._KEYS:
+            setattr(self, self._KEYS[key], value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._KEYS or (self._extra is not None and key in self._extra)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._KEYS:
+            value = getattr(self, self._KEYS[key], None)
+        else:
+            value = self._extra.get(key) if self._extra is not None else None
+        return default if value is None else value
+
+    def keys(self) -> List[str]:
+        return list(self.to_dict())
+
+    def to_dict(self) -> dict:
+        """转换回接口返回的dict, 嵌套的记录也会转换
+        """
+        data = {key: plain(self[key]) for key in self._layout}
+        # 接口没有返回、后来通过属性赋值的字段
+        for _, key in self.FIELDS:
+            if key not in data and self[key] not in (None, []):
+                data[key] = plain(self[key])
+        return data
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+def plain(value: Any) -> Any:
+    """把记录和记录列表转换成dict和list, 用于命令行输出和序列化
+    """
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [plain(v) for v in value]
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items()}
+    return value
+
+
+class ResourceRecord(Record):
+    __slots__ = ('id', 'creator_id', 'created_ts', 'updated_ts', 'filename', 'external_link',
+                 'type', 'size', 'linked_memo_amount')
+    FIELDS = (
+        ('id', 'id'),
+        ('creator_id', 'creatorId'),
+        ('created_ts', 'createdTs'),
+        ('updated_ts', 'updatedTs'),
+        ('filename', 'filename'),
+        ('external_link', 'externalLink'),
+        ('type', 'type'),
+        ('size', 'size'),
+        ('linked_memo_amount', 'linkedMemoAmount'),
+    )
+
+
+class MemoRecord(Record):
+    """memo记录, resourceList在第一次访问时才转换成ResourceRecord
+    """
+    __slots__ = ('id', 'row_status', 'creator_id', 'created_ts', 'updated_ts', 'content',
+                 'visibility', 'pinned', 'creator_name', '_resources')
+    FIELDS = (
+        ('id', 'id'),
+        ('row_status', 'rowStatus'),
+        ('creator_id', 'creatorId'),
+        ('created_ts', 'createdTs'),
+        ('updated_ts', 'updatedTs'),
+        ('content', 'content'),
+        ('visibility', 'visibility'),
+        ('pinned', 'pinned'),
+        ('creator_name', 'creatorName'),
+        ('resources', 'resourceList'),
+    )
+
+    @property
+    def resources(self) -> List[ResourceRecord]:
+        raw = self._resources
+        if raw and not isinstance(raw[0], ResourceRecord):
+            self._resources = raw = [ResourceRecord(r) for r in raw]
+        return raw or []
+
+    @resources.setter
+    def resources(self, value: list | None) -> None:
+        self._resources = value
+
+
+def memo_records(items: List[dict]) -> List[MemoRecord]:
+    """原地把dict换成MemoRecord, 每条dict转换后立即释放, 峰值内存不会叠加两份
+    """
+    for i, m in enumerate(items):
+        items[i] = MemoRecord(m)
+    return items
+
+
+def resource_records(items: List[dict]) -> List[ResourceRecord]:
+    for i, r in enumerate(items):
+        items[i] = ResourceRecord(r)
+    return items
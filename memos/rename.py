@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import difflib
+import re
+
+from typing import Dict, List
+
+# memos的tag规则: #后面直到空白、#或逗号为止, 前面可以是换行或标点
+TAG_PREFIX = r'(?<![A-Za-z0-9_/#&])#'
+TAG_PATTERN = re.compile(TAG_PREFIX + r'([^\s#,]+)')
+
+
+def find_tags(content: str) -> List[str]:
+    """按出现顺序返回content里的tag, 不带#
+    """
+    return TAG_PATTERN.findall(content)
+
+
+class TagRewriter:
+    """把old->new的tag映射编译成一个正则, 一次遍历就能完成多个tag的替换
+
+    tag按TAG_PATTERN的规则识别.
+    嵌套tag会跟着父tag改名, 例如a->x时#a/b变成#x/b, 映射里更长的tag优先.
+    """
+    def __init__(self, mapping: Dict[str, str]):
+        self.mapping = {str(old).strip('#'): str(new).strip('#') for old, new in mapping.items()}
+        names = sorted(self.mapping, key=len, reverse=True)
+        self.pattern = re.compile(TAG_PREFIX + '(' + '|'.join(map(re.escape, names)) + r')(?=[/\s#,]|$)')
+
+    def _replace(self, match: re.Match) -> str:
+        return f'#{self.mapping[match.group(1)]}'
+
+    def rewrite(self, content: str) -> str:
+        """替换content里所有需要改名的tag, 没有匹配时原样返回
+        """
+        return self.pattern.sub(self._replace, content)
+
+    @staticmethod
+    def diff(memo_id: int, old: str, new: str) -> str:
+        return '\n'.join(difflib.unified_diff(
+            old.splitlines(),
+            new.splitlines(),
+            fromfile=f'memo/{memo_id}',
+            tofile=f'memo/{memo_id}',
+            lineterm=''
+        ))
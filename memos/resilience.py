@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""按主机的限速、重试、超时和熔断
+
+每个Memos主机一个HostPolicy: 令牌桶限制请求速率, HostRetry按指数退避加随机抖动重试并遵守429的Retry-After,
+CircuitBreaker在主机连续失败后直接拒绝请求, 由后台任务定期探测, 恢复后再放行.
+"""
+
+import asyncio
+import os
+import random
+import time
+
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Tuple
+from urllib.parse import urlparse
+from aiohttp import ClientConnectionError, ClientConnectorError, ClientResponse
+from aiohttp_retry import ExponentialRetry
+from loguru import logger
+
+
+
+class CircuitOpenError(Exception):
+    """主机处于熔断状态, 请求没有发出"""
+
+
+class TokenBucket:
+    """令牌桶, rate为每秒补充的令牌数, burst为桶容量, rate小于等于0时不限速
+    """
+    def __init__(self, rate: float = 0, burst: int = 10):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self.waited = 0.0
+
+    def reserve(self) -> float:
+        """预定一个令牌, 返回需要等待的秒数, 令牌不够时预支未来的令牌
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        self.waited += delay
+        return delay
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def retry_after(response: ClientResponse | None) -> float | None:
+    """解析Retry-After, 支持秒数和HTTP日期两种格式"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostRetry(ExponentialRetry):
+    """指数退避加全抖动的重试, 429和503带Retry-After时至少等待指定时间, 每次重试前也从令牌桶取令牌
+
+    Args:
+        bucket (TokenBucket): 所属主机的令牌桶
+        max_retry_after (float, optional): Retry-After的上限, 防止服务器要求等待太久. Defaults to 60.
+    """
+    def __init__(self, bucket: TokenBucket, max_retry_after: float = 60, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket = bucket
+        self.max_retry_after = max_retry_after
+
+    def get_timeout(self, attempt: int, response: ClientResponse | None = None) -> float:
+        delay = random.uniform(0, super().get_timeout(attempt, response))
+        wait = retry_after(response)
+        if wait is not None:
+            delay = max(delay, min(wait, self.max_retry_after))
+        if response is not None:
+            # 这次响应不会再被读取, 先把连接还回连接池
+            response.release()
+        return delay + self.bucket.reserve()
+
+
+class CircuitBreaker:
+    """连续失败failures次后熔断, 熔断期间请求直接抛出CircuitOpenError, 后台任务按退避间隔探测主机, 探测成功后恢复
+
+    Args:
+        host (str): 主机, 用于日志
+        probe (Callable[[], Awaitable[bool]]): 探测函数, 主机可用时返回True
+        failures (int, optional): 触发熔断的连续失败次数. Defaults to 5.
+        reset_timeout (float, optional): 第一次探测前等待的秒数, 之后每次翻倍, 最多60秒. Defaults to 10.
+    """
+    def __init__(self, host: str, probe: Callable[[], Awaitable[bool]], failures: int = 5, reset_timeout: float = 10):
+        self.host = host
+        self.probe = probe
+        self.threshold = max(1, failures)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.opened = 0
+        self.rejected = 0
+        self._probe_task: asyncio.Task | None = None
+
+    @property
+    def state(self) -> str:
+        return 'open' if self.opened_at is not None else 'closed'
+
+    def check(self) -> None:
+        if self.opened_at is not None:
+            self.rejected += 1
+            raise CircuitOpenError(f'{self.host}不可用, 已熔断{time.monotonic() - self.opened_at:.0f}秒')
+
+    def record_success(self) -> None:
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.opened_at is None and self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self.opened += 1
+            logger.error(f'{self.host}连续失败{self.failures}次，熔断并在后台探测')
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe_until_closed())
+
+    def close(self) -> None:
+        self.opened_at = None
+        self.failures = 0
+
+    async def _probe_until_closed(self) -> None:
+        delay = self.reset_timeout
+        while self.opened_at is not None:
+            await asyncio.sleep(delay)
+            try:
+                ok = await self.probe()
+            except Exception as e:
+                logger.debug(f'探测{self.host}失败，{e!r}')
+                ok = False
+            if ok:
+                logger.info(f'{self.host}已恢复，关闭熔断')
+                self.close()
+            else:
+                delay = min(delay * 2, 60)
+
+    def cancel(self) -> None:
+        if self._probe_task is not None and not self._probe_task.done():
+            self._probe_task.cancel()
+
+
+class HostPolicy:
+    """一个主机的令牌桶、熔断器和各类操作的重试配置
+    """
+    def __init__(self, host: str, probe: Callable[[], Awaitable[bool]]):
+        self.host = host
+        self.bucket = TokenBucket(rate=float(os.getenv('MEMOS_RATE', 0)), burst=int(os.getenv('MEMOS_BURST', 10)))
+        self.breaker = CircuitBreaker(host, probe,
+                                      failures=int(os.getenv('MEMOS_BREAKER_FAILURES', 5)),
+                                      reset_timeout=float(os.getenv('MEMOS_BREAKER_RESET', 10)))
+        attempts = int(os.getenv('MEMOS_RETRIES', 3))
+        # 每类操作的总时长上限(秒), 包含所有重试和等待; 和其他配置一样在创建时读取, .env里的值也能生效
+        self.deadlines = {
+            'read': float(os.getenv('MEMOS_TIMEOUT_READ', 15)),
+            'write': float(os.getenv('MEMOS_TIMEOUT_WRITE', 30)),
+            'upload': float(os.getenv('MEMOS_TIMEOUT_UPLOAD', 300)),
+        }
+        self.connect_timeout = float(os.getenv('MEMOS_CONNECT_TIMEOUT', 5))
+        self.retries = {
+            # 读取是幂等的, 服务器错误、429和连接错误都可以重试
+            'read': HostRetry(self.bucket, attempts=attempts, statuses={429},
+                              exceptions={ClientConnectionError, asyncio.TimeoutError}),
+            # 写入只在确定服务器没有处理时重试: 没连上、429、503
+            'write': HostRetry(self.bucket, attempts=attempts, statuses={429, 503}, retry_all_server_errors=False,
+                               exceptions={ClientConnectorError}),
+            # 流式请求体只能发送一次, 不能重试
+            'upload': HostRetry(self.bucket, attempts=1),
+        }
+
+    def stats(self) -> dict:
+        return {
+            'state': self.breaker.state,
+            'failures': self.breaker.failures,
+            'opened': self.breaker.opened,
+            'rejected': self.breaker.rejected,
+            'throttled_seconds': round(self.bucket.waited, 3)
+        }
+
+
+class HostPolicies:
+    """按scheme+netloc保存HostPolicy
+
+    Args:
+        probe (Callable[[str], Awaitable[bool]]): 参数为主机根地址的探测函数
+    """
+    def __init__(self, probe: Callable[[str], Awaitable[bool]]):
+        self.probe = probe
+        self._policies: Dict[Tuple[str, str], HostPolicy] = {}
+
+    def get(self, url: str) -> HostPolicy:
+        url_parts = urlparse(str(url))
+        key = (url_parts.scheme, url_parts.netloc)
+        policy = self._policies.get(key)
+        if policy is None:
+            base = f'{url_parts.scheme}://{url_parts.netloc}'
+            policy = self._policies[key] = HostPolicy(url_parts.netloc, lambda: self.probe(base))
+        return policy
+
+    def stats(self) -> dict:
+        return {policy.host: policy.stats() for policy in self._policies.values()}
+
+    def prometheus(self) -> str:
+        lines = ['# TYPE memos_circuit_open gauge']
+        lines += [f'memos_circuit_open{{host="{p.host}"}} {int(p.breaker.state == "open")}' for p in self._policies.values()]
+        lines.append('# TYPE memos_circuit_rejected_total counter')
+        lines += [f'memos_circuit_rejected_total{{host="{p.host}"}} {p.breaker.rejected}' for p in self._policies.values()]
+        lines.append('# TYPE memos_throttled_seconds_total counter')
+        lines += [f'memos_throttled_seconds_total{{host="{p.host}"}} {p.bucket.waited:.3f}' for p in self._policies.values()]
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        for policy in self._policies.values():
+            policy.breaker.cancel()
+        self._policies.clear()
@@ -2,110 +2,185 @@
 # coding=utf-8
 
 import asyncio
-from typing import List
+import os
+from typing import Dict, List
 from loguru import logger
 from memos.memosapi import  Memo, Resource, Tag, VISIBILITY
+from memos.records import MemoRecord
+from memos.bulk import BulkExecutor
+from memos.importer import Importer
+from memos.metrics import request_metrics
+from memos.rename import TagRewriter
 from fire import Fire
 
 class Tool:
     """一些网页不好操作的批量操作工具
     """
-    def __init__(self):
-        self.memo = Memo()
-        self.tag = Tag()
-        self.res = Resource()
-
-    async def rename_tag(self, old_tag: str, new_tag: str, deleted: bool =False) -> None:
-        """重命名tag
+    def __init__(self, concurrency: int = 8, rate: float = 0, retries: int = 2, report: str = None, resume: str = None, token: str = None, metrics: bool = False):
+        """
+        Args:
+            concurrency (int, optional): 批量请求的并发上限. Defaults to 8.
+            rate (float, optional): 每秒最多请求数, 0为不限速. Defaults to 0.
+            retries (int, optional): 单条失败后的重试次数. Defaults to 2.
+            report (str, optional): 结果报告写入的json文件. Defaults to None.
+            resume (str, optional): 上一次的报告文件, 跳过已成功的条目. Defaults to None.
+            token (str, optional): Memos Open API, 默认使用环境变量OPEN_API. Defaults to None.
+            metrics (bool, optional): 结束时打印每个接口的请求统计. Defaults to False.
+        """
+        request_metrics.report_at_exit = metrics
+        token = token or os.getenv('OPEN_API')
+        self.memo = Memo(token)
+        self.tag = Tag(token)
+        self.res = Resource(token)
+        self.executor = BulkExecutor(concurrency=concurrency, rate=rate, retries=retries, report=report, resume=resume)
+
+    async def rename_tag(self,
+                         old_tag: str = None,
+                         new_tag: str = None,
+                         deleted: bool =False,
+                         mapping: Dict[str, str] = None,
+                         dry_run: bool = False) -> dict | None:
+        """重命名tag, 可以用mapping一次重命名多个tag, 只遍历一遍memo
 
         Args:
-            old_tag (str): 旧的名字
-            new_tag (str): 新的名字
+            old_tag (str, optional): 旧的名字. Defaults to None.
+            new_tag (str, optional): 新的名字. Defaults to None.
             deleted (bool, optional): 旧的tag是否删除,默认不删除. Defaults to False.
+            mapping (Dict[str, str], optional): 旧tag到新tag的映射, 例如'{"a": "b", "c": "d"}'. Defaults to None.
+            dry_run (bool, optional): 只打印每条memo的修改, 不更新. Defaults to False.
+
+        Returns:
+            dict | None: 执行汇总
         """
+        mapping = dict(mapping or {})
+        if old_tag is not None and new_tag is not None:
+            mapping[old_tag] = new_tag
         tags = await self.tag.get_tags()
-        if old_tag in tags:
-            logger.debug('找到TAG，删除并新建')
-        else:
+        for old in list(mapping):
+            if old in tags:
+                logger.debug(f'找到TAG{old}，删除并新建')
+            else:
+                logger.debug(f'未找到需要重命名的TAG{old}')
+                del mapping[old]
+        if not mapping:
             logger.debug(f'未找到需要重命名的TAG')
             return
 
-        memos = self.memo.filter_memo(tag=old_tag)
-        data: List[dict] = []
-        for m in await memos:
-            content_list: List[str] = m['content'].split(' ')
-            text = []
-            for content in content_list:
-                # 解析无法处理一下特殊情况
-                if content.startswith(f'#{old_tag}'):
-                    text.append(f'#{new_tag}')
-                # elif f'#{old_tag}' in content:
-                #     text.append(content)
-                else:
-                    text.append(content)
-            data.append({'id': m['id'], 'content': ' '.join(text)})
+        rewriter = TagRewriter(mapping)
+        # 更新会改变memo的排序和tag筛选结果, 边分页边更新会漏掉或重复, 所以先遍历全部memo在本地匹配, 再统一更新
+        renamed = []
+        async for m in self.memo.iter_memos():
+            content = rewriter.rewrite(m['content'])
+            if content != m['content']:
+                if dry_run:
+                    print(rewriter.diff(m['id'], m['content'], content))
+                renamed.append({'id': m['id'], 'content': content})
 
+        if dry_run:
+            return {'name': 'rename_tag', 'dry_run': True, 'changed': len(renamed)}
 
-        if data:
-            func = lambda x: self.memo.update_memo(memo_id=x['id'], text=x['content'])
-            tasks = [asyncio.create_task(func(d)) for d in data]
-            finished, unfinished = await asyncio.wait(tasks)
-            all_results = [r.result() for r in finished]
-            logger.debug(all_results)
-            for result in all_results:
-                logger.debug(f'{result}\n')
+        func = lambda x: self.memo.update_memo(memo_id=x['id'], text=x['content'])
+        report = await self.executor.run('rename_tag', renamed, func, key=lambda x: x['id'])
 
-        await self.tag.create_tag(new_tag)
+        await self.tag.ensure_tags(list(mapping.values()))
         if deleted:
-            await self.tag.delete_tag(old_tag)
+            for old in mapping:
+                await self.tag.delete_tag(old)
+        return report.summary()
 
-    async def public_memos(self, tags_list: str | List[str], visibility: VISIBILITY = 'PUBLIC', reverse: bool = True) -> None:
-        """批量调整memo的状态
+    async def public_memos(self, tags_list: str | List[str], visibility: VISIBILITY = 'PUBLIC', reverse: bool = True, dry_run: bool = False) -> dict:
+        """批量调整memo的可见性
+
+        先并发获取每个tag的全部memo, 在本地计算并集或交集, 已经是目标可见性的memo不发请求.
 
         Args:
             tags_list (str | List[str]): 让某个tag或tag列表全部调整可见性
             visibility (VISIBILITY, optional): 可见性. Defaults to 'PUBLIC'.
-            reverse (bool, optional): List可用, True时取交集, 默认为并集. Defaults to True.
+            reverse (bool, optional): List可用, True时取并集, False时取交集. Defaults to True.
+            dry_run (bool, optional): 只统计需要修改的memo, 不更新. Defaults to False.
+
+        Returns:
+            dict: 执行汇总, planned为选中的memo数, unchanged为已经是目标可见性而跳过的数量, saved_requests为省掉的请求数
         """
-   
-        memo_ids = set()
-        reverse_ids = set()
-        tags = await self.tag.get_tags()
         if type(tags_list) is list:
             logger.debug('公开List')
+            tags = await self.tag.get_tags()
+            matched = []
             for t in tags_list:
                 if t in tags:
                     logger.debug(f'{t}在tags中，准备公开TAG')
-                    ml = await self.memo.filter_memo(tag=t)
-                    logger.debug(f'包含TAG:{t}的内容为{ml}')
-                    for m in ml:
-                        logger.debug(f'TAG的内容为{m}')
-                        if reverse:
-                            memo_ids.add(m['id'])
-                        elif m['id'] in memo_ids:
-                            reverse_ids.add(m['id'])
-                        else:
-                            memo_ids.add(m['id'])
+                    matched.append(t)
                 else:
                     logger.debug(f'{t}不在tags中，不处理')
         else:
             logger.debug('公开一个tag')
-            ml = await self.memo.filter_memo(tag=tags_list)
-            for m in ml:
-                memo_ids.add(m['id'])
-
-
-        func = lambda x:  self.memo.update_memo(memo_id=x, visibility=visibility)
-        if reverse and len(memo_ids) != 0:
-            logger.debug(f'memos_id为：{memo_ids}')
-            tasks = [asyncio.create_task(func(a)) for a in list(memo_ids)]
-        elif len(reverse_ids) != 0:
-            logger.debug(f'reverse_ids为：{reverse_ids}')
-            tasks = [asyncio.create_task(func(a)) for a in list(reverse_ids)]
+            matched = [tags_list]
+
+        async def tag_memos(tag: str) -> Dict[int, MemoRecord]:
+            return {m['id']: m async for m in self.memo.iter_memos(tag=tag)}
+
+        # 每个tag各自分页, 不同tag之间并发
+        results = await asyncio.gather(*[tag_memos(t) for t in matched])
+        selected: Dict[int, MemoRecord] = {}
+        if results and not reverse:
+            common = set(results[0]).intersection(*results[1:])
+            selected = {memo_id: results[0][memo_id] for memo_id in common}
+            logger.debug(f'reverse_ids为：{common}')
         else:
+            for r in results:
+                selected.update(r)
+        targets = []
+        for m in selected.values():
+            if m['visibility'] == visibility:
+                request_metrics.record_saved('PATCH', f'/{self.memo.memo_path}/{m["id"]}', 'noop')
+            else:
+                targets.append(m)
+        unchanged = len(selected) - len(targets)
+        plan = {'planned': len(selected), 'unchanged': unchanged, 'saved_requests': unchanged}
+        if dry_run:
+            return {'name': 'public_memos', 'dry_run': True, 'changed': len(targets), **plan}
+
+        func = lambda m: self.memo.update_memo(memo_id=m['id'], visibility=visibility, current=m)
+        report = await self.executor.run('public_memos', targets, func, key=lambda m: m['id'])
+        if not selected:
             logger.debug(f'Tag未匹配，不执行任何操作')
-            return
-        await asyncio.wait(tasks)
+        return {**report.summary(), **plan}
+
+    async def clear_resource(self) -> dict | None:
+        """清除未被使用的资源，谨慎操作！！！
+
+        Returns:
+            dict | None: 有删除时返回执行汇总
+        """
+        return await self.res.clear_resource(executor=self.executor)
+
+    async def resource_gc(self, dry_run: bool = False, min_age: float = 0, batch_size: int = 0) -> dict:
+        """删除未被使用的资源, 只获取一次资源列表, 按--concurrency和--rate删除
+
+        Args:
+            dry_run (bool, optional): 只列出会删除的资源. Defaults to False.
+            min_age (float, optional): 只删除创建超过这么多秒的资源. Defaults to 0.
+            batch_size (int, optional): 本次最多删除的数量, 0为不限制. Defaults to 0.
+
+        Returns:
+            dict: 执行汇总
+        """
+        return await self.res.gc(dry_run=dry_run, min_age=min_age, batch_size=batch_size, executor=self.executor)
+
+    async def import_memos(self, source: str, visibility: VISIBILITY = 'PRIVATE', checkpoint: str = None, upload_concurrency: int = 4) -> dict:
+        """从Markdown目录或JSONL文件批量导入memo, 本地图片作为资源上传, 命令行里也可以用`tool import`
+
+        Args:
+            source (str): Markdown目录或JSONL文件, JSONL每行需要content, 可选id、visibility和resources
+            visibility (VISIBILITY, optional): 默认可见性. Defaults to 'PRIVATE'.
+            checkpoint (str, optional): 检查点文件, 中断后重新运行会跳过已完成的部分, 默认为<source>.import.jsonl. Defaults to None.
+            upload_concurrency (int, optional): 同时上传的资源数, 创建memo的并发由concurrency控制. Defaults to 4.
+
+        Returns:
+            dict: 执行汇总
+        """
+        importer = Importer(self.memo.token, self.executor, upload_concurrency=upload_concurrency)
+        return await importer.run(source, visibility=visibility, checkpoint=checkpoint)
 
     async def send_memos(self):
         """测试用
@@ -116,6 +191,9 @@ class Tool:
         tasks = [asyncio.create_task(self.memo.send_memo(text=f'#test #ssss {i}')) for i in range(10)]
         return await asyncio.wait(tasks)
 
+# import是关键字, 只能这样注册`tool import`命令
+setattr(Tool, 'import', Tool.import_memos)
+
 if __name__ == '__main__':
     Fire({
         'memo': Memo,